@@ -3,53 +3,76 @@
 """
 import pandas as pd
 
-# 读取预测结果
+# 读取预测结果和训练数据
 predictions = pd.read_csv('outputs/entrez_run_2025-12-23_21-20-38/compound_predictions.csv')
+training = pd.read_csv('outputs/entrez_run_2025-12-23_21-20-38/prepared_training_data.csv')
+positive_samples = training[training['label'] == 1]
+
+# 检查重叠情况
+# 求交和成员判断都交给pandas Index内部的C级哈希表完成，不经过Python set
+pos_idx = pd.Index(positive_samples['SMILES'].dropna().unique())
+pred_idx = pd.Index(predictions['SMILES'].dropna().unique())
+overlap = pos_idx.intersection(pred_idx)
 
 # 统计概率分布
+# 先标记每条预测是否与正样本重叠，再用一次分组聚合同时得到重叠/非重叠两组的全部统计量，
+# 总体统计由两组结果相加得到，避免对概率列反复扫描
+# 阈值比较交给DataFrame.eval一次性完成（安装numexpr时自动使用其引擎），不逐个生成中间布尔数组
+flags = predictions[['predicted_probability']].rename(columns={'predicted_probability': 'p'}).eval(
+    """
+    p_eq1 = p == 1.0
+    p_ge99 = p >= 0.99
+    p_ge90 = p >= 0.9
+    p_ge50 = p >= 0.5
+    p_lt50 = p < 0.5
+    """
+)
+flags['is_overlap'] = predictions['SMILES'].isin(overlap)
+stats = flags.groupby('is_overlap').agg(
+    count=('p', 'size'),
+    mean=('p', 'mean'),
+    p_eq1=('p_eq1', 'sum'),
+    p_ge99=('p_ge99', 'sum'),
+    p_ge90=('p_ge90', 'sum'),
+    p_ge50=('p_ge50', 'sum'),
+    p_lt50=('p_lt50', 'sum'),
+).reindex([True, False])
+count_cols = ['count', 'p_eq1', 'p_ge99', 'p_ge90', 'p_ge50', 'p_lt50']
+stats[count_cols] = stats[count_cols].fillna(0).astype(int)
+total = stats[count_cols].sum()
+
 print('=== 预测概率分布统计 ===')
 print(f'总预测数: {len(predictions)}')
-print(f'概率 = 1.0 的数量: {(predictions["predicted_probability"] == 1.0).sum()}')
-print(f'概率 >= 0.99 的数量: {(predictions["predicted_probability"] >= 0.99).sum()}')
-print(f'概率 >= 0.9 的数量: {(predictions["predicted_probability"] >= 0.9).sum()}')
-print(f'概率 >= 0.5 的数量: {(predictions["predicted_probability"] >= 0.5).sum()}')
-print(f'概率 < 0.5 的数量: {(predictions["predicted_probability"] < 0.5).sum()}')
+print(f'概率 = 1.0 的数量: {total["p_eq1"]}')
+print(f'概率 >= 0.99 的数量: {total["p_ge99"]}')
+print(f'概率 >= 0.9 的数量: {total["p_ge90"]}')
+print(f'概率 >= 0.5 的数量: {total["p_ge50"]}')
+print(f'概率 < 0.5 的数量: {total["p_lt50"]}')
 print()
 
-# 读取训练数据
-training = pd.read_csv('outputs/entrez_run_2025-12-23_21-20-38/prepared_training_data.csv')
-positive_samples = training[training['label'] == 1]
 print(f'=== 训练数据统计 ===')
 print(f'正样本数: {len(positive_samples)}')
 print(f'未标记样本数: {len(training) - len(positive_samples)}')
 print()
 
-# 检查重叠情况
-positive_smiles = set(positive_samples['SMILES'].values)
-pred_smiles = set(predictions['SMILES'].values)
-overlap = positive_smiles.intersection(pred_smiles)
 print(f'=== 关键发现：正样本与预测目标的重叠 ===')
-print(f'正样本SMILES数: {len(positive_smiles)}')
-print(f'预测目标SMILES数: {len(pred_smiles)}')
+print(f'正样本SMILES数: {len(pos_idx)}')
+print(f'预测目标SMILES数: {len(pred_idx)}')
 print(f'重叠的SMILES数: {len(overlap)}')
 print()
 
 # 检查重叠的化合物预测概率
 if len(overlap) > 0:
-    overlap_predictions = predictions[predictions['SMILES'].isin(overlap)]
     print(f'重叠化合物的预测概率统计:')
-    print(f'  平均概率: {overlap_predictions["predicted_probability"].mean():.4f}')
-    print(f'  概率 = 1.0 的数量: {(overlap_predictions["predicted_probability"] == 1.0).sum()}')
-    print(f'  概率 >= 0.99 的数量: {(overlap_predictions["predicted_probability"] >= 0.99).sum()}')
+    print(f'  平均概率: {stats.at[True, "mean"]:.4f}')
+    print(f'  概率 = 1.0 的数量: {stats.at[True, "p_eq1"]}')
+    print(f'  概率 >= 0.99 的数量: {stats.at[True, "p_ge99"]}')
     print()
-    
+
     # 非重叠化合物的概率分布
-    non_overlap_predictions = predictions[~predictions['SMILES'].isin(overlap)]
     print(f'非重叠化合物的预测概率统计:')
-    print(f'  数量: {len(non_overlap_predictions)}')
-    print(f'  平均概率: {non_overlap_predictions["predicted_probability"].mean():.4f}')
-    print(f'  概率 = 1.0 的数量: {(non_overlap_predictions["predicted_probability"] == 1.0).sum()}')
-    print(f'  概率 >= 0.99 的数量: {(non_overlap_predictions["predicted_probability"] >= 0.99).sum()}')
-    print(f'  概率 >= 0.9 的数量: {(non_overlap_predictions["predicted_probability"] >= 0.9).sum()}')
-
-
+    print(f'  数量: {stats.at[False, "count"]}')
+    print(f'  平均概率: {stats.at[False, "mean"]:.4f}')
+    print(f'  概率 = 1.0 的数量: {stats.at[False, "p_eq1"]}')
+    print(f'  概率 >= 0.99 的数量: {stats.at[False, "p_ge99"]}')
+    print(f'  概率 >= 0.9 的数量: {stats.at[False, "p_ge90"]}')
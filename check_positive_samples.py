@@ -13,12 +13,19 @@ from data_pipeline import data_loader
 def check_codes(icd_codes_to_check: list):
     """
     检查一个ICD-11代码列表，并识别出哪些代码拥有正样本。
+    查找表和D13索引只在本进程中构建和加载一次，之后每个代码的查找都是内存中的字典/二分查找，依次检查即可。
 
     Args:
         icd_codes_to_check (list): 一个包含ICD-11代码字符串的列表。
     """
     logging.info(f"开始检查 {len(icd_codes_to_check)} 个ICD代码...")
     
+    try:
+        data_loader.preload_lookups(config)
+    except Exception as e:
+        # 预加载失败时不中断，各代码的查找会各自报告错误
+        logging.error(f"预加载查找表失败: {e}")
+
     codes_with_positives = []
 
     for code in icd_codes_to_check:
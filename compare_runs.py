@@ -1,17 +1,32 @@
 import pandas as pd
+from pathlib import Path
 
 runs = ['entrez_run_2025-12-23_21-20-38', 'entrez_run_2025-12-24_12-04-54']
 
+def load_table(csv_path, columns):
+    """读取结果表，优先使用同名Parquet（排名步骤会直接写出，或首次读取CSV后写入缓存），便于之后反复比较"""
+    csv_path = Path(csv_path)
+    parquet_path = csv_path.with_suffix('.parquet')
+    if parquet_path.exists() and (not csv_path.exists() or parquet_path.stat().st_mtime >= csv_path.stat().st_mtime):
+        return pd.read_parquet(parquet_path, columns=columns)
+    df = pd.read_csv(csv_path)
+    df.to_parquet(parquet_path, compression='snappy', index=False)
+    return df[columns]
+
 for run in runs:
     print(f'\n===== {run} =====')
-    herbs = pd.read_csv(f'outputs/{run}/herb_ranking_comprehensive.csv')
-    compounds = pd.read_csv(f'outputs/{run}/compound_predictions_with_names.csv')
-    
+    herbs = load_table(f'outputs/{run}/herb_ranking_comprehensive.csv', ['rank', 'CHP_ID', 'Chinese_herbal_pieces'])
+    compounds = load_table(f'outputs/{run}/compound_predictions_with_names.csv', ['CHP_ID', 'InChIKey', 'predicted_probability'])
+
+    # 一次排序 + 分组取前10，得到所有中药的Top化合物，再按CHP_ID建立字典
+    top_per_herb = compounds.sort_values('predicted_probability', ascending=False, kind='stable').groupby('CHP_ID', sort=False).head(10)
+    top_by_herb = {chp_id: group for chp_id, group in top_per_herb.groupby('CHP_ID', sort=False)}
+    empty = top_per_herb.iloc[0:0]
+
     for _, row in herbs.head(10).iterrows():
         chp_id, name = row['CHP_ID'], row['Chinese_herbal_pieces']
         print(f"\n[{int(row['rank'])}] {name} ({chp_id})")
-        top = compounds[compounds['CHP_ID']==chp_id].nlargest(10, 'predicted_probability')
+        top = top_by_herb.get(chp_id, empty)
         for i, (_, c) in enumerate(top.iterrows(), 1):
             # print(f"  {i}. {c['InChIKey']} | prob={c['predicted_probability']:.4f}")
             print(f"  {i}. {c['InChIKey']}")
-
@@ -4,21 +4,21 @@
 """
 import pandas as pd
 import logging
+from multiprocessing import Pool
 from pathlib import Path
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# 常见的立体化学标记的删除表，预先构建一次
+_STEREO_MARKERS_TABLE = str.maketrans('', '', '@/\\')
+
 def remove_stereochemistry(smiles):
     """
     去除SMILES中的立体化学标记
     """
-    # 去除常见的立体化学标记
-    stereo_markers = ['@', '/', '\\']
-    cleaned = smiles
-    for marker in stereo_markers:
-        cleaned = cleaned.replace(marker, '')
-    return cleaned
+    # 一次translate在C层完成全部删除，避免多次replace产生中间字符串
+    return smiles.translate(_STEREO_MARKERS_TABLE)
 
 def canonicalize_simple(smiles):
     """
@@ -48,6 +48,27 @@ def try_rdkit_canonicalize(smiles):
     except:
         return None
 
+def _match_on_canonical(smiles1, smiles2, canonicalize, canonical_col, map_func=map):
+    """
+    按规范化SMILES连接两组SMILES，返回所有匹配对。
+    canonicalize返回None的SMILES（例如RDKit无法解析）不参与匹配。
+    map_func用于批量执行canonicalize，可传入进程池的map以并行处理。
+    """
+    smiles1 = list(smiles1)
+    smiles2 = list(smiles2)
+    df1 = pd.DataFrame({
+        canonical_col: list(map_func(canonicalize, smiles1)),
+        'SMILES_from_inchikeys': smiles1
+    }).dropna(subset=[canonical_col])
+    df2 = pd.DataFrame({
+        canonical_col: list(map_func(canonicalize, smiles2)),
+        'SMILES_from_bace': smiles2
+    }).dropna(subset=[canonical_col])
+    
+    df_matches = df1.merge(df2, on=canonical_col)
+    df_matches['Exact_Match'] = df_matches['SMILES_from_inchikeys'] == df_matches['SMILES_from_bace']
+    return df_matches[['SMILES_from_inchikeys', 'SMILES_from_bace', canonical_col, 'Exact_Match']]
+
 def main():
     # 检查文件是否存在
     file1 = Path("inchikeys_with_smiles.csv")
@@ -90,41 +111,11 @@ def main():
     logging.info("方法2: 去除立体化学标记后匹配")
     logging.info("="*60)
     
-    # 创建映射：规范化SMILES -> 原始SMILES列表
-    map1 = {}
-    for s in smiles1:
-        canonical = canonicalize_simple(s)
-        if canonical not in map1:
-            map1[canonical] = []
-        map1[canonical].append(s)
-    
-    map2 = {}
-    for s in smiles2:
-        canonical = canonicalize_simple(s)
-        if canonical not in map2:
-            map2[canonical] = []
-        map2[canonical].append(s)
-    
-    # 找到匹配的规范化SMILES
-    canonical_matches = set(map1.keys()).intersection(set(map2.keys()))
-    
-    # 统计总匹配数（考虑一对多的情况）
-    total_matches = 0
-    match_details = []
-    
-    for canonical in canonical_matches:
-        smiles1_list = map1[canonical]
-        smiles2_list = map2[canonical]
-        
-        for s1 in smiles1_list:
-            for s2 in smiles2_list:
-                total_matches += 1
-                match_details.append({
-                    'SMILES_from_inchikeys': s1,
-                    'SMILES_from_bace': s2,
-                    'Canonical': canonical,
-                    'Exact_Match': s1 == s2
-                })
+    # 为两侧分别建立 (规范化SMILES, 原始SMILES) 表，再按规范化SMILES做哈希连接
+    # 连接结果即为所有匹配对（自然包含一对多的情况）
+    df_matches = _match_on_canonical(smiles1, smiles2, canonicalize_simple, 'Canonical')
+    canonical_matches = set(df_matches['Canonical'])
+    total_matches = len(df_matches)
     
     logging.info(f"规范化后匹配的唯一结构数: {len(canonical_matches)}")
     logging.info(f"总匹配对数: {total_matches}")
@@ -137,43 +128,19 @@ def main():
         logging.info("方法3: 使用RDKit规范化SMILES（去除立体化学）")
         logging.info("="*60)
         
-        # 创建RDKit规范化映射
-        rdkit_map1 = {}
-        rdkit_map2 = {}
-        
-        for s in smiles1:
-            canonical = try_rdkit_canonicalize(s)
-            if canonical:
-                if canonical not in rdkit_map1:
-                    rdkit_map1[canonical] = []
-                rdkit_map1[canonical].append(s)
-        
-        for s in smiles2:
-            canonical = try_rdkit_canonicalize(s)
-            if canonical:
-                if canonical not in rdkit_map2:
-                    rdkit_map2[canonical] = []
-                rdkit_map2[canonical].append(s)
-        
-        rdkit_matches = set(rdkit_map1.keys()).intersection(set(rdkit_map2.keys()))
+        # 创建RDKit规范化映射并连接，无法解析的SMILES会被丢弃
+        # 每个分子的RDKit规范化相互独立，使用进程池并行处理
+        with Pool() as pool:
+            df_rdkit_matches = _match_on_canonical(
+                smiles1, smiles2, try_rdkit_canonicalize, 'Canonical_SMILES',
+                map_func=lambda func, items: pool.map(func, items, chunksize=256)
+            )
+        rdkit_matches = set(df_rdkit_matches['Canonical_SMILES'])
         
         logging.info(f"RDKit规范化后匹配的唯一结构数: {len(rdkit_matches)}")
         
-        # 保存RDKit匹配详情
-        rdkit_details = []
-        for canonical in rdkit_matches:
-            for s1 in rdkit_map1[canonical]:
-                for s2 in rdkit_map2[canonical]:
-                    rdkit_details.append({
-                        'SMILES_from_inchikeys': s1,
-                        'SMILES_from_bace': s2,
-                        'Canonical_SMILES': canonical,
-                        'Exact_Match': s1 == s2
-                    })
-        
         # 保存RDKit结果
-        if rdkit_details:
-            df_rdkit_matches = pd.DataFrame(rdkit_details)
+        if not df_rdkit_matches.empty:
             output_rdkit = Path("smiles_matches_rdkit.csv")
             df_rdkit_matches.to_csv(output_rdkit, index=False)
             logging.info(f"RDKit匹配详情已保存到: {output_rdkit}")
@@ -182,28 +149,26 @@ def main():
         logging.warning("未安装RDKit，跳过方法3")
     
     # 保存匹配详情
-    if match_details:
-        df_matches = pd.DataFrame(match_details)
+    if not df_matches.empty:
         output_file = Path("smiles_matches.csv")
         df_matches.to_csv(output_file, index=False)
         logging.info(f"\n匹配详情已保存到: {output_file}")
         
         # 统计完全相同的匹配
-        exact_matches = df_matches[df_matches['Exact_Match'] == True]
-        logging.info(f"其中完全相同的SMILES: {len(exact_matches)}")
-        logging.info(f"仅结构相同但有立体化学差异的: {len(df_matches) - len(exact_matches)}")
+        exact_count = int(df_matches['Exact_Match'].sum())
+        logging.info(f"其中完全相同的SMILES: {exact_count}")
+        logging.info(f"仅结构相同但有立体化学差异的: {len(df_matches) - exact_count}")
     
     # 显示一些示例
     logging.info("\n" + "="*60)
     logging.info("匹配示例（前5个）:")
     logging.info("="*60)
     
-    if match_details:
-        for i, detail in enumerate(match_details[:5], 1):
-            logging.info(f"\n示例 {i}:")
-            logging.info(f"  inchikeys文件: {detail['SMILES_from_inchikeys']}")
-            logging.info(f"  bace文件:      {detail['SMILES_from_bace']}")
-            logging.info(f"  完全相同:      {detail['Exact_Match']}")
+    for i, detail in enumerate(df_matches.head(5).to_dict('records'), 1):
+        logging.info(f"\n示例 {i}:")
+        logging.info(f"  inchikeys文件: {detail['SMILES_from_inchikeys']}")
+        logging.info(f"  bace文件:      {detail['SMILES_from_bace']}")
+        logging.info(f"  完全相同:      {detail['Exact_Match']}")
     
     # 总结
     logging.info("\n" + "="*60)
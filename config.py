@@ -14,6 +14,7 @@ TCM_DATA_ROOT = Path("D:/TCM")
 # 用于存放每次运行时生成的中间文件和最终结果
 OUTPUTS_DIR = PROJECT_ROOT / "outputs"
 MODELS_DIR = PROJECT_ROOT / "models"
+CACHE_DIR = PROJECT_ROOT / "cache" # 由原始TSV转换得到的列式缓存文件
 # 为当前运行创建一个唯一的子目录，以时间戳命名，避免覆盖
 RUN_ID = None # 将在主程序中设置
 
@@ -27,8 +28,11 @@ ICD11_DOID_FILE = "D21_ICD11_DOID.tsv"
 CUI_TARGETS_FILE = "D22_CUI_targets.tsv" # CUI -> EntrezID
 MESH_TARGETS_FILE = "D23_MeSH_targets.tsv"
 DOID_TARGETS_FILE = "D24_DOID_targets.tsv"
+ICD11_ENTREZ_PARQUET = "ICD11_EntrezID.parquet" # 三条通路合并后的 ICD11 -> EntrezID 查找表 (位于CACHE_DIR)
+CONCEPT_TARGETS_PARQUET = "concept_targets.parquet" # D22/D23/D24合并后的 (来源, 概念ID, EntrezID) 长表 (位于CACHE_DIR)
 
 INCHIKEY_ENTREZ_FILE = "D13_InChIKey_EntrezID.tsv" # EntrezID -> InChIKey
+INCHIKEY_ENTREZ_PARQUET = "D13_InChIKey_EntrezID.parquet" # D13按EntrezID排序后的Parquet缓存 (位于CACHE_DIR)
 HERB_COMPOUNDS_FILE = "D9_CHP_InChIKey.tsv" # 中药 -> InChIKey
 HERB_NAMES_FILE = "D6_Chinese_herbal_pieces.tsv" # 中药ID -> 中药名
 
@@ -36,17 +40,23 @@ HERB_NAMES_FILE = "D6_Chinese_herbal_pieces.tsv" # 中药ID -> 中药名
 # 用于将InChIKey转换为SMILES的文件，或作为背景/阴性样本
 INCHIKEY_SMILES_FILE = PROJECT_ROOT.parent / "牙周炎.csv" # 预计算的SMILES缓存
 LOCAL_INCHIKEY_SMILES_TSV = TCM_DATA_ROOT / "D12_InChIKey.tsv" # 从本地TSV文件获取SMILES
+INCHIKEY_SMILES_PARQUET = "D12_InChIKey_SMILES.parquet" # D12去重后的InChIKey-SMILES Parquet缓存 (位于CACHE_DIR)
 UNLABELED_SAMPLES_FILE = PROJECT_ROOT / "chembl29.csv" # 背景化合物库 (ChEMBL29)
 SMILES_CACHE_FILE = PROJECT_ROOT / "smiles_cache.csv" # 用于缓存InChIKey-SMILES对
+UNIPROT_ENTREZ_CACHE = "uniprot_entrez.sqlite" # UniProt -> EntrezID 在线查询结果的SQLite缓存 (位于CACHE_DIR)
+UNIPROT_CACHE_TTL_DAYS = 30 # 缓存条目的有效天数，过期后重新查询
 
 # --- 机器学习模型参数 ---
 N_ESTIMATORS = 10  # PU-Bagging中的基学习器数量
 MAX_EPOCHS = 20  # 神经网络训练的最大轮次
 NUM_WORKERS = 0  # 数据加载器的工作线程数 (0表示在主线程中加载)
 RANDOM_SEED = 42 # 随机种子，确保结果可复现
+USE_MIXED_PRECISION = True # 在GPU上使用混合精度训练和预测 (支持时用bf16，否则用fp16)
+PREDICTION_CACHE_SIZE = 10 # CACHE_DIR中最多保留的化合物预测结果缓存数量 (按最近使用淘汰)
 
 # --- 评分参数 ---
 BAYESIAN_ALPHA = 10  # 贝叶斯平均分先验强度 (可调)
+EXPORT_NAMED_PREDICTIONS_CSV = True  # 除Parquet外是否同时导出带中药名称的化合物预测CSV
 
 # --- 列名配置 ---
 # 统一管理数据文件中用到的列名，方便维护
@@ -4,15 +4,15 @@ Convert UniProt IDs from Excel file to Entrez IDs and run herb prediction pipeli
 This script:
 1. Reads UniProt IDs from an Excel file
 2. Converts them to Entrez Gene IDs using UniProt REST API
-3. Runs the main.py pipeline to train model and predict herbs
+3. Runs the main.py pipeline in-process to train model and predict herbs
 """
 
 import pandas as pd
-import subprocess
 import sys
 import logging
 from pathlib import Path
 from uniprot_entrzid import map_uniprot_to_entrez
+from main import run_pipeline
 
 # Configure logging
 logging.basicConfig(
@@ -21,7 +21,9 @@ logging.basicConfig(
     handlers=[
         logging.StreamHandler(),
         logging.FileHandler('conversion.log', mode='w', encoding='utf-8')
-    ]
+    ],
+    # Replace the default handler installed by basicConfig calls in the imported pipeline modules
+    force=True
 )
 
 def main():
@@ -90,7 +92,7 @@ def main():
         logging.error("No valid Entrez IDs found. Cannot proceed with prediction.")
         sys.exit(1)
     
-    # Step 3: Run main.py with the Entrez IDs
+    # Step 3: Run the main.py pipeline with the Entrez IDs
     entrez_ids_str = ",".join(entrez_ids)
     logging.info(f"\nPreparing to run herb prediction with Entrez IDs: {entrez_ids_str}")
     logging.info("=" * 60)
@@ -98,21 +100,20 @@ def main():
     logging.info("=" * 60)
     
     try:
-        # Run main.py with the converted Entrez IDs
-        cmd = [sys.executable, "main.py", "--entrez_ids", entrez_ids_str]
-        logging.info(f"Command: {' '.join(cmd)}")
+        # Call the pipeline directly instead of spawning a new interpreter,
+        # so already-imported libraries and module-level caches are reused
+        final_ranking_path = run_pipeline(entrez_ids)
         
-        result = subprocess.run(cmd, check=True, capture_output=False, text=True)
+        if final_ranking_path is None:
+            logging.error("main.py pipeline did not complete.")
+            logging.error("Check run.log in the outputs directory for details.")
+            sys.exit(1)
         
         logging.info("=" * 60)
         logging.info("Pipeline completed successfully!")
         logging.info("=" * 60)
-        logging.info("Check the outputs/ directory for results.")
+        logging.info(f"Final herb ranking: {final_ranking_path}")
         
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error running main.py: {e}")
-        logging.error("Check run.log in the outputs directory for details.")
-        sys.exit(1)
     except Exception as e:
         logging.error(f"Unexpected error: {e}", exc_info=True)
         sys.exit(1)
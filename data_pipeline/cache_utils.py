@@ -0,0 +1,79 @@
+"""
+CACHE_DIR 中缓存文件的公共工具：新鲜度检查、原子写入，以及Arrow表转pandas时的字符串类型映射。
+各缓存构建函数都通过这里判断是否需要重建并写出结果，缓存失效规则只需在此处维护。
+"""
+import json
+import os
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+
+# Arrow字符串列转换为pandas时保持为Arrow字符串（string[pyarrow]），不为每个值创建Python字符串对象
+_ARROW_STRING_DTYPES = {
+    pa.string(): pd.StringDtype("pyarrow"),
+    pa.large_string(): pd.StringDtype("pyarrow"),
+}
+
+
+def string_types_mapper(arrow_type):
+    """用作 Table.to_pandas(types_mapper=...)：字符串列映射为string[pyarrow]，其余类型使用默认转换"""
+    return _ARROW_STRING_DTYPES.get(arrow_type)
+
+
+def cached_source_files(cache_path: Path):
+    """读取Parquet缓存元数据中记录的源文件名集合（b'source_files'）；缓存不存在或没有该记录时返回None"""
+    cache_path = Path(cache_path)
+    if not cache_path.exists():
+        return None
+    metadata = pq.read_schema(cache_path).metadata or {}
+    if b'source_files' not in metadata:
+        return None
+    return set(json.loads(metadata[b'source_files']))
+
+
+def is_cache_fresh(cache_path: Path, source_paths, track_sources: bool = False) -> bool:
+    """
+    缓存存在且不比任何现存的源文件旧时返回True。
+    track_sources=True 时还要求缓存元数据中记录的源文件集合与当前存在的源文件一致，
+    这样构建时缺失或无法读取的源文件之后可用时，缓存会被重新构建。
+    """
+    cache_path = Path(cache_path)
+    if not cache_path.exists():
+        return False
+    existing_sources = [Path(p) for p in source_paths if Path(p).exists()]
+    if track_sources and cached_source_files(cache_path) != {p.name for p in existing_sources}:
+        return False
+    cache_mtime = cache_path.stat().st_mtime
+    return all(cache_mtime >= p.stat().st_mtime for p in existing_sources)
+
+
+def _tmp_path_for(path: Path) -> Path:
+    """同目录下带进程号的临时文件名：多个进程同时构建同一缓存时互不覆盖，替换前读者也看不到写了一半的文件"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path.with_suffix(f'.{os.getpid()}.tmp')
+
+
+def write_parquet_atomic(table: pa.Table, parquet_path: Path, source_files=None, **write_kwargs):
+    """
+    将Arrow表写入临时文件后原子替换为parquet_path，write_kwargs透传给pq.write_table。
+    source_files 不为None时将源文件名集合记录到schema元数据中，供 is_cache_fresh(track_sources=True) 比较。
+    """
+    parquet_path = Path(parquet_path)
+    if source_files is not None:
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            b'source_files': json.dumps(sorted(source_files)).encode(),
+        })
+    tmp_path = _tmp_path_for(parquet_path)
+    pq.write_table(table, tmp_path, **write_kwargs)
+    tmp_path.replace(parquet_path)
+
+
+def copy_file_atomic(src_path: Path, dst_path: Path):
+    """将文件复制到临时文件后原子替换为dst_path"""
+    dst_path = Path(dst_path)
+    tmp_path = _tmp_path_for(dst_path)
+    shutil.copyfile(src_path, tmp_path)
+    tmp_path.replace(dst_path)
@@ -1,132 +1,308 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 from pathlib import Path
 import logging
 
+from data_pipeline.cache_utils import is_cache_fresh, string_types_mapper, write_parquet_atomic
+
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def _find_entrez_ids_via_path(icd11_code, config, id_map_file, target_map_file, id_col, id_name):
-    """辅助函数：通过单一通路查找EntrezID"""
-    entrez_ids = set()
-    try:
-        # 1. ICD11 -> 中间ID (CUI/MeSH/DOID)
-        id_map_path = config.TCM_DATA_ROOT / id_map_file
-        logging.info(f"[{id_name} Path] 正在读取ICD映射文件: {id_map_path}")
-        df_id_map = pd.read_csv(id_map_path, sep='\t', usecols=[config.ICD11_CODE_COL, id_col], dtype=str)
-        intermediate_ids = df_id_map[df_id_map[config.ICD11_CODE_COL] == icd11_code][id_col].unique()
-
-        if len(intermediate_ids) == 0:
-            logging.warning(f"[{id_name} Path] 未找到 ICD11 '{icd11_code}' 对应的 {id_name}。")
-            return entrez_ids
-        logging.info(f"[{id_name} Path] 找到 {len(intermediate_ids)} 个相关 {id_name}。")
-
-        # 2. 中间ID -> EntrezID
-        target_map_path = config.TCM_DATA_ROOT / target_map_file
-        logging.info(f"[{id_name} Path] 正在读取靶点映射文件: {target_map_path}")
-        df_target_map = pd.read_csv(target_map_path, sep='\t', usecols=[id_col, config.ENTREZ_ID_COL], dtype=str)
-        found_entrez_ids = df_target_map[df_target_map[id_col].isin(intermediate_ids)][config.ENTREZ_ID_COL].unique()
-        
-        if len(found_entrez_ids) > 0:
-            logging.info(f"[{id_name} Path] 找到 {len(found_entrez_ids)} 个相关 EntrezID。")
-            entrez_ids.update(found_entrez_ids)
+# 全局变量，用于缓存D13的列式索引：(按EntrezID排序的uint32数组, 对齐的定长InChIKey字节数组)
+_d13_index = None
+# 全局变量，用于缓存 ICD11 -> EntrezID集合 的查询字典
+_icd_entrez_lookup = None
 
-    except FileNotFoundError as e:
-        logging.error(f"[{id_name} Path] 数据文件未找到: {e}")
-    except Exception as e:
-        logging.error(f"[{id_name} Path] 处理过程中发生错误: {e}")
-        
-    return entrez_ids
+def _icd_entrez_paths(config):
+    """三条疾病通路的 (ICD映射文件, 靶点映射文件, 中间ID列, 通路名称)"""
+    return [
+        (config.DISEASE_ICD11_FILE, config.CUI_TARGETS_FILE, config.CUI_COL, "CUI"),
+        (config.ICD11_MESH_FILE, config.MESH_TARGETS_FILE, config.MESH_COL, "MeSH"),
+        (config.ICD11_DOID_FILE, config.DOID_TARGETS_FILE, config.DOID_COL, "DOID"),
+    ]
 
 
-def find_positive_samples(icd11_code: str, config) -> pd.DataFrame:
+def _ensure_icd_entrez_parquet(config) -> Path:
     """
-    根据给定的ICD11代码，通过CUI, MeSH, DOID三条通路查找关联的化合物InChIKeys（正样本）。
+    辅助函数：确保 ICD11 -> EntrezID 查找表的Parquet缓存存在并且是最新的，返回缓存路径。
+    查找表由 D19⋈D22、D20⋈D23、D21⋈D24 三条通路连接后合并去重得到，只需构建一次。
+    缓存元数据中记录了成功参与构建的源文件；若当前存在的源文件与之不一致（例如缺失的通路文件后来补齐），
+    或任一源文件比缓存新，则重新构建。
     """
-    logging.info(f"开始为ICD11代码 '{icd11_code}' 通过三通路模型查找正样本...")
+    parquet_path = config.CACHE_DIR / config.ICD11_ENTREZ_PARQUET
+    source_paths = [
+        config.TCM_DATA_ROOT / file_name
+        for id_map_file, target_map_file, _, _ in _icd_entrez_paths(config)
+        for file_name in (id_map_file, target_map_file)
+    ]
+    if is_cache_fresh(parquet_path, source_paths, track_sources=True):
+        return parquet_path
 
-    # --- 兵分三路查找EntrezID ---
-    entrez_ids_cui = _find_entrez_ids_via_path(
-        icd11_code, config, config.DISEASE_ICD11_FILE, config.CUI_TARGETS_FILE, config.CUI_COL, "CUI"
-    )
-    entrez_ids_mesh = _find_entrez_ids_via_path(
-        icd11_code, config, config.ICD11_MESH_FILE, config.MESH_TARGETS_FILE, config.MESH_COL, "MeSH"
+    logging.info("正在构建 ICD11 -> EntrezID 查找表: %s（仅需执行一次）", parquet_path)
+    frames = []
+    used_files = set()
+    for id_map_file, target_map_file, id_col, id_name in _icd_entrez_paths(config):
+        # 每条通路单独容错，一条通路出错不影响其余通路
+        try:
+            # ICD11 -> 中间ID (CUI/MeSH/DOID)，再由中间ID -> EntrezID
+            df_id_map = pd.read_csv(config.TCM_DATA_ROOT / id_map_file, sep='\t', usecols=[config.ICD11_CODE_COL, id_col], dtype=str)
+            df_target_map = pd.read_csv(config.TCM_DATA_ROOT / target_map_file, sep='\t', usecols=[id_col, config.ENTREZ_ID_COL], dtype=str)
+            df_path = df_id_map.merge(df_target_map, on=id_col)[[config.ICD11_CODE_COL, config.ENTREZ_ID_COL]]
+        except FileNotFoundError as e:
+            logging.error("[%s Path] 数据文件未找到: %s", id_name, e)
+            continue
+        except Exception as e:
+            logging.error("[%s Path] 处理过程中发生错误: %s", id_name, e)
+            continue
+        logging.info("[%s Path] 连接得到 %s 条 ICD11-EntrezID 关联。", id_name, len(df_path))
+        frames.append(df_path)
+        used_files.update((id_map_file, target_map_file))
+
+    if not frames:
+        raise FileNotFoundError("三条通路的映射文件均未找到或无法读取，无法构建 ICD11 -> EntrezID 查找表。")
+
+    df_icd_entrez = (
+        pd.concat(frames, ignore_index=True)
+        .dropna()
+        .drop_duplicates()
+        .sort_values([config.ICD11_CODE_COL, config.ENTREZ_ID_COL], ignore_index=True)
     )
-    entrez_ids_doid = _find_entrez_ids_via_path(
-        icd11_code, config, config.ICD11_DOID_FILE, config.DOID_TARGETS_FILE, config.DOID_COL, "DOID"
+    write_parquet_atomic(pa.Table.from_pandas(df_icd_entrez, preserve_index=False), parquet_path, source_files=used_files)
+    logging.info("ICD11 -> EntrezID 查找表已生成，共 %s 条关联。", len(df_icd_entrez))
+    return parquet_path
+
+
+def _load_icd_entrez_lookup(config) -> dict:
+    """
+    从Parquet缓存加载 ICD11 -> EntrezID集合 的查询字典，并将其缓存在全局变量中。
+    如果已经加载，则直接返回。
+    """
+    global _icd_entrez_lookup
+    if _icd_entrez_lookup is not None:
+        return _icd_entrez_lookup
+
+    parquet_path = _ensure_icd_entrez_parquet(config)
+    df_icd_entrez = pd.read_parquet(parquet_path, columns=[config.ICD11_CODE_COL, config.ENTREZ_ID_COL])
+    _icd_entrez_lookup = {
+        icd11_code: set(group[config.ENTREZ_ID_COL])
+        for icd11_code, group in df_icd_entrez.groupby(config.ICD11_CODE_COL, sort=False)
+    }
+    logging.info("成功加载并缓存 %s 个ICD11代码的EntrezID映射。", len(_icd_entrez_lookup))
+    return _icd_entrez_lookup
+
+
+def _parse_entrez_ids(ids):
+    """
+    辅助函数：将EntrezID字符串数组（去除首尾空白后）按uint64解析，返回 (解析结果, 有效掩码)。
+    仅由数字组成且不超出uint32范围的ID视为有效，无效位置的解析结果为0。解析与校验均在Arrow内核中向量化完成。
+    """
+    ids = pc.utf8_trim_whitespace(ids)
+    # 先用纯数字和长度过滤，再按uint64解析并排除超出uint32范围的值
+    is_valid = pc.fill_null(pc.and_(pc.utf8_is_digit(ids), pc.less_equal(pc.utf8_length(ids), 10)), False)
+    as_uint64 = pc.cast(pc.if_else(is_valid, ids, "0"), pa.uint64())
+    is_valid = pc.and_(is_valid, pc.less_equal(as_uint64, np.iinfo(np.uint32).max))
+
+    invalid_ids = ids.filter(pc.invert(is_valid))
+    if len(invalid_ids) > 0:
+        logging.warning("忽略 %d 个无法解析为整数的EntrezID (示例: %r)", len(invalid_ids), invalid_ids[:5].to_pylist())
+    return as_uint64, is_valid
+
+
+def _to_entrez_id_array(all_entrez_ids) -> np.ndarray:
+    """
+    辅助函数：将EntrezID集合（Python集合或pyarrow字符串数组）转换为排序去重后的uint32数组，
+    跳过无法解析为uint32整数的ID。
+    """
+    if isinstance(all_entrez_ids, pa.Array):
+        ids = all_entrez_ids.cast(pa.string())
+    else:
+        ids = pa.array([str(e) for e in all_entrez_ids], type=pa.string())
+    as_uint64, is_valid = _parse_entrez_ids(ids)
+    return np.unique(as_uint64.filter(is_valid).to_numpy().astype(np.uint32))
+
+
+def _ensure_inchikey_entrez_parquet(config) -> Path:
+    """
+    辅助函数：确保D13的Parquet缓存存在并且不比原始TSV旧，返回缓存路径。
+    缓存按EntrezID排序并对其做字典编码，查询时可借助行组的min/max统计跳过无关数据块。
+    """
+    d13_path = config.TCM_DATA_ROOT / config.INCHIKEY_ENTREZ_FILE
+    parquet_path = config.CACHE_DIR / config.INCHIKEY_ENTREZ_PARQUET
+    if is_cache_fresh(parquet_path, [d13_path]):
+        return parquet_path
+
+    logging.info("正在将 %s 转换为Parquet缓存: %s（仅需执行一次）", d13_path, parquet_path)
+    table = pacsv.read_csv(
+        d13_path,
+        parse_options=pacsv.ParseOptions(delimiter='\t'),
+        convert_options=pacsv.ConvertOptions(
+            include_columns=[config.INCHIKEY_COL, config.ENTREZ_ID_COL],
+            # EntrezID先按字符串读取，个别无法解析的值只丢弃对应行，不会导致整个缓存构建失败
+            column_types={config.INCHIKEY_COL: pa.string(), config.ENTREZ_ID_COL: pa.string()}
+        )
     )
-    
-    # --- 合并EntrezID并集 ---
-    all_entrez_ids = entrez_ids_cui.union(entrez_ids_mesh).union(entrez_ids_doid)
-    if not all_entrez_ids:
-        logging.error("所有通路均未找到任何相关的EntrezID，流程终止。")
+    as_uint64, is_valid = _parse_entrez_ids(table[config.ENTREZ_ID_COL])
+    table = table.filter(is_valid).set_column(
+        table.schema.get_field_index(config.ENTREZ_ID_COL),
+        config.ENTREZ_ID_COL,
+        as_uint64.filter(is_valid).cast(pa.uint32())
+    ).sort_by(config.ENTREZ_ID_COL)
+
+    write_parquet_atomic(table, parquet_path, row_group_size=500_000, use_dictionary=[config.ENTREZ_ID_COL])
+    logging.info("Parquet缓存已生成，共 %s 行。", table.num_rows)
+    return parquet_path
+
+
+def _load_d13_index(config):
+    """
+    从Parquet缓存加载D13，转换为两个平行的NumPy数组并缓存在全局变量中，供批量查询使用。
+    EntrezID为排序后的uint32数组，InChIKey为对齐的定长|S27字节数组：
+    InChIKey列在Arrow中转换为fixed_size_binary(27)后直接按其数据缓冲区（零拷贝视图）写入，不创建任何Python字符串对象，
+    并可通过二分查找定位每个EntrezID的区间。
+    """
+    global _d13_index
+    if _d13_index is not None:
+        return _d13_index
+
+    parquet_path = _ensure_inchikey_entrez_parquet(config)
+    logging.info("正在从 %s 加载D13列式索引...", parquet_path)
+    # 按行组读取并写入预先分配的数组，峰值内存约为最终索引加一个行组的大小
+    parquet_file = pq.ParquetFile(parquet_path)
+    n_rows = parquet_file.metadata.num_rows
+    entrez = np.empty(n_rows, dtype=np.uint32)
+    inchikeys = np.empty(n_rows, dtype='|S27')
+    n_filled = 0
+    for i in range(parquet_file.num_row_groups):
+        table = parquet_file.read_row_group(i, columns=[config.INCHIKEY_COL, config.ENTREZ_ID_COL])
+        key_lengths = pc.binary_length(table.column(config.INCHIKEY_COL))
+        is_valid = pc.fill_null(pc.and_(pc.equal(key_lengths, 27), pc.is_valid(table.column(config.ENTREZ_ID_COL))), False)
+        table = table.filter(is_valid)
+        n = table.num_rows
+        if n == 0:
+            continue
+        entrez[n_filled:n_filled + n] = table.column(config.ENTREZ_ID_COL).combine_chunks().to_numpy()
+        keys = pc.cast(table.column(config.INCHIKEY_COL), pa.binary(27)).combine_chunks()
+        inchikeys[n_filled:n_filled + n] = np.frombuffer(keys.buffers()[1], dtype='|S27', count=n, offset=keys.offset * 27)
+        n_filled += n
+    if n_filled < n_rows:
+        logging.warning("忽略D13中 %d 条缺失值或长度不为27的InChIKey记录。", n_rows - n_filled)
+        entrez, inchikeys = entrez[:n_filled].copy(), inchikeys[:n_filled].copy()
+
+    # 缓存写入时已按EntrezID排序，只有排序被破坏时才重新排序
+    if len(entrez) > 1 and np.any(entrez[1:] < entrez[:-1]):
+        order = np.argsort(entrez, kind='stable')
+        entrez, inchikeys = entrez[order], inchikeys[order]
+
+    _d13_index = (entrez, inchikeys)
+    logging.info("成功加载并缓存 %s 条EntrezID-InChIKey映射。", len(entrez))
+    return _d13_index
+
+
+def preload_lookups(config):
+    """
+    为批量查询（多个ICD11代码）预先构建所需缓存并加载 ICD11 -> EntrezID 查询字典和D13内存索引。
+    加载后find_positive_samples对D13使用内存中的二分查找；未预加载时单次查询通过Parquet谓词下推读取。
+    """
+    _load_icd_entrez_lookup(config)
+    _load_d13_index(config)
+
+
+def _find_inchikeys_by_entrez_ids(all_entrez_ids, config) -> pd.DataFrame:
+    """
+    辅助函数：查找与给定EntrezID集合关联的唯一InChIKey。
+    已预加载D13内存索引（批量路径）时在排序后的EntrezID数组上二分查找每个ID的区间；
+    否则通过Parquet缓存的谓词下推只读取包含目标EntrezID的行组，适合一次性查询。
+    """
+    # EntrezID是数值型基因ID，按uint32比较，避免逐行的字符串哈希与比较
+    queries = _to_entrez_id_array(all_entrez_ids)
+    logging.info("正在查找与 %s 个EntrezID相关的InChIKey...", len(all_entrez_ids))
+
+    if _d13_index is not None:
+        entrez, inchikeys = _d13_index
+        lo = np.searchsorted(entrez, queries, side='left')
+        hi = np.searchsorted(entrez, queries, side='right')
+        # 各区间作为Arrow分块直接去重（C级哈希表），不拼接副本，也不创建Python字符串对象
+        matches = pa.chunked_array(
+            [pa.array(inchikeys[l:h]) for l, h in zip(lo, hi) if h > l],
+            type=pa.binary()
+        )
+    else:
+        parquet_path = _ensure_inchikey_entrez_parquet(config)
+        matches = ds.dataset(parquet_path, format='parquet').to_table(
+            columns=[config.INCHIKEY_COL],
+            # 与内存索引保持一致，只保留长度为27的有效InChIKey
+            filter=ds.field(config.ENTREZ_ID_COL).isin(pa.array(queries, type=pa.uint32()))
+            & (pc.binary_length(ds.field(config.INCHIKEY_COL)) == 27)
+        ).column(config.INCHIKEY_COL)
+
+    if len(matches) == 0:
+        logging.warning("未找到与EntrezID相关联的InChIKey。")
         return pd.DataFrame({config.INCHIKEY_COL: []})
-    logging.info(f"通过所有通路共找到 {len(all_entrez_ids)} 个独特的EntrezID。")
 
-    # --- EntrezID -> InChIKey ---
-    try:
-        d13_path = config.TCM_DATA_ROOT / config.INCHIKEY_ENTREZ_FILE
-        logging.info(f"正在从 {d13_path} 中查找与 {len(all_entrez_ids)} 个EntrezID相关的InChIKey...")
-        
-        chunk_size = 1_000_000 
-        inchikey_list = []
-        
-        with pd.read_csv(d13_path, sep='\t', usecols=[config.INCHIKEY_COL, config.ENTREZ_ID_COL], chunksize=chunk_size, dtype=str) as reader:
-            for chunk in reader:
-                matches = chunk[chunk[config.ENTREZ_ID_COL].isin(all_entrez_ids)]
-                if not matches.empty:
-                    inchikey_list.extend(matches[config.INCHIKEY_COL].tolist())
-        
-        unique_inchikeys = list(set(inchikey_list))
-        
-        if not unique_inchikeys:
-            logging.warning("未找到与EntrezID相关联的InChIKey。")
-            return pd.DataFrame({config.INCHIKEY_COL: []})
-
-        logging.info(f"成功找到 {len(unique_inchikeys)} 个独特的InChIKey作为正样本。")
-        return pd.DataFrame(unique_inchikeys, columns=[config.INCHIKEY_COL])
+    unique_inchikeys = pc.cast(pc.unique(matches), pa.string())
+    logging.info("成功找到 %s 个独特的InChIKey作为正样本。", len(unique_inchikeys))
+    return pd.DataFrame({config.INCHIKEY_COL: unique_inchikeys.to_pandas(types_mapper=string_types_mapper)})
+
 
+def find_entrez_ids_by_inchikey(inchikey: str, config) -> set:
+    """
+    查找单个化合物（InChIKey）关联的EntrezID集合。
+    对D13的Parquet缓存做带过滤条件的列式读取，只取出EntrezID列，适合一次性查询。
+    """
+    parquet_path = _ensure_inchikey_entrez_parquet(config)
+    matches = ds.dataset(parquet_path, format='parquet').to_table(
+        columns=[config.ENTREZ_ID_COL],
+        filter=ds.field(config.INCHIKEY_COL) == inchikey
+    ).column(config.ENTREZ_ID_COL)
+    return set(pc.unique(matches.drop_null()).to_pylist())
+
+
+def find_positive_samples(icd11_code: str, config) -> pd.DataFrame:
+    """
+    根据给定的ICD11代码，通过CUI, MeSH, DOID三条通路查找关联的化合物InChIKeys（正样本）。
+    """
+    logging.info("开始为ICD11代码 '%s' 通过三通路模型查找正样本...", icd11_code)
+
+    # --- ICD11 -> EntrezID（三条通路已预先合并为一张查找表） ---
+    try:
+        all_entrez_ids = _load_icd_entrez_lookup(config).get(icd11_code, set())
     except FileNotFoundError as e:
-        logging.error(f"数据文件未找到: {e}")
+        logging.error("数据文件未找到: %s", e)
         return pd.DataFrame({config.INCHIKEY_COL: []})
     except Exception as e:
-        logging.error(f"在查找InChIKey过程中发生未知错误: {e}")
+        logging.error("在查找EntrezID过程中发生未知错误: %s", e)
+        return pd.DataFrame({config.INCHIKEY_COL: []})
+
+    if not all_entrez_ids:
+        logging.error("所有通路均未找到任何相关的EntrezID，流程终止。")
         return pd.DataFrame({config.INCHIKEY_COL: []})
+    logging.info("通过所有通路共找到 %s 个独特的EntrezID。", len(all_entrez_ids))
+
+    # --- EntrezID -> InChIKey ---
+    return find_positive_samples_by_entrez(all_entrez_ids, config)
 
-def find_positive_samples_by_entrez(all_entrez_ids: set, config) -> pd.DataFrame:
+def find_positive_samples_by_entrez(all_entrez_ids, config) -> pd.DataFrame:
     """
     根据给定的EntrezID集合，查找关联的化合物InChIKeys（正样本）。
+    all_entrez_ids 可以是字符串集合，也可以是pyarrow字符串数组。
     """
-    if not all_entrez_ids:
+    if len(all_entrez_ids) == 0:
         logging.error("输入的EntrezID集合为空，流程终止。")
         return pd.DataFrame({config.INCHIKEY_COL: []})
-    logging.info(f"接收到 {len(all_entrez_ids)} 个独特的EntrezID，开始查找正样本...")
+    logging.info("接收到 %s 个独特的EntrezID，开始查找正样本...", len(all_entrez_ids))
 
     # --- EntrezID -> InChIKey ---
     try:
-        d13_path = config.TCM_DATA_ROOT / config.INCHIKEY_ENTREZ_FILE
-        logging.info(f"正在从 {d13_path} 中查找与 {len(all_entrez_ids)} 个EntrezID相关的InChIKey...")
-        
-        chunk_size = 1_000_000 
-        inchikey_list = []
-        
-        with pd.read_csv(d13_path, sep='\t', usecols=[config.INCHIKEY_COL, config.ENTREZ_ID_COL], chunksize=chunk_size, dtype=str) as reader:
-            for chunk in reader:
-                matches = chunk[chunk[config.ENTREZ_ID_COL].isin(all_entrez_ids)]
-                if not matches.empty:
-                    inchikey_list.extend(matches[config.INCHIKEY_COL].tolist())
-        
-        unique_inchikeys = list(set(inchikey_list))
-        
-        if not unique_inchikeys:
-            logging.warning("未找到与EntrezID相关联的InChIKey。")
-            return pd.DataFrame({config.INCHIKEY_COL: []})
-
-        logging.info(f"成功找到 {len(unique_inchikeys)} 个独特的InChIKey作为正样本。")
-        return pd.DataFrame(unique_inchikeys, columns=[config.INCHIKEY_COL])
+        return _find_inchikeys_by_entrez_ids(all_entrez_ids, config)
 
     except FileNotFoundError as e:
-        logging.error(f"数据文件未找到: {e}")
+        logging.error("数据文件未找到: %s", e)
         return pd.DataFrame({config.INCHIKEY_COL: []})
     except Exception as e:
-        logging.error(f"在查找InChIKey过程中发生未知错误: {e}")
+        logging.error("在查找InChIKey过程中发生未知错误: %s", e)
         return pd.DataFrame({config.INCHIKEY_COL: []}) 
\ No newline at end of file
@@ -1,36 +1,62 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import logging
 from pathlib import Path
-from tqdm import tqdm
 
-# 全局变量，用于缓存从本地文件加载的SMILES查询字典
+from data_pipeline.cache_utils import is_cache_fresh, string_types_mapper, write_parquet_atomic
+
+# 全局变量，用于缓存从本地文件加载的SMILES查询表（以InChIKey为索引的Series）
 _smiles_lookup = None
 
-def _load_smiles_lookup(config):
+def _ensure_smiles_parquet(config) -> Path:
     """
-    从本地TSV文件加载InChIKey到SMILES的映射，并将其缓存在全局变量中。
-    如果已经加载，则直接返回。
+    辅助函数：确保InChIKey-SMILES的Parquet缓存存在并且不比原始TSV旧，返回缓存路径。
+    缓存中只保留去重后的两列，之后的运行无需再解析TSV文本。
     """
-    global _smiles_lookup
-    if _smiles_lookup is not None:
-        return
-
     smiles_tsv_path = config.LOCAL_INCHIKEY_SMILES_TSV
     inchikey_col = config.INCHIKEY_COL
     smiles_col = config.SMILES_COL
 
-    logging.info(f"正在从本地文件加载SMILES数据: {smiles_tsv_path}")
     if not smiles_tsv_path.exists():
         logging.error(f"SMILES数据文件未找到: {smiles_tsv_path}!")
         raise FileNotFoundError(f"SMILES数据文件未找到: {smiles_tsv_path}!")
 
-    # 使用制表符作为分隔符读取TSV文件
-    df = pd.read_csv(smiles_tsv_path, sep='\\t', header=0, usecols=[inchikey_col, smiles_col], engine='python')
+    parquet_path = config.CACHE_DIR / config.INCHIKEY_SMILES_PARQUET
+    if is_cache_fresh(parquet_path, [smiles_tsv_path]):
+        return parquet_path
+
+    logging.info(f"正在将 {smiles_tsv_path} 转换为Parquet缓存: {parquet_path}（仅需执行一次）")
+    # 使用制表符作为分隔符，由pyarrow多线程解析器读取TSV文件
+    df = pd.read_csv(smiles_tsv_path, sep='\t', header=0, usecols=[inchikey_col, smiles_col],
+                     engine='pyarrow', dtype_backend='pyarrow')
     df.dropna(subset=[inchikey_col], inplace=True)
     df.drop_duplicates(subset=[inchikey_col], keep='first', inplace=True)
 
-    # 创建查询字典并存入全局缓存
-    _smiles_lookup = pd.Series(df[smiles_col].values, index=df[inchikey_col]).to_dict()
+    write_parquet_atomic(pa.Table.from_pandas(df, preserve_index=False), parquet_path, compression='zstd')
+    return parquet_path
+
+
+def _load_smiles_lookup(config):
+    """
+    从Parquet缓存加载InChIKey到SMILES的映射，并将其缓存在全局变量中。
+    如果已经加载，则直接返回。
+    """
+    global _smiles_lookup
+    if _smiles_lookup is not None:
+        return
+
+    inchikey_col = config.INCHIKEY_COL
+    smiles_col = config.SMILES_COL
+
+    parquet_path = _ensure_smiles_parquet(config)
+    logging.info(f"正在从本地文件加载SMILES数据: {parquet_path}")
+    # 以内存映射方式只读取两列，InChIKey和SMILES直接作为Arrow字符串，避免为每个键创建Python字符串对象
+    table = pq.read_table(parquet_path, columns=[inchikey_col, smiles_col], memory_map=True)
+    df = table.to_pandas(types_mapper=string_types_mapper)
+
+    # 创建以InChIKey为索引的查询表并存入全局缓存
+    _smiles_lookup = df.set_index(inchikey_col)[smiles_col]
     logging.info(f"成功加载并缓存 {len(_smiles_lookup)} 条InChIKey-SMILES映射。")
 
 def get_smiles_for_inchikeys(inchikeys_df: pd.DataFrame, config) -> pd.DataFrame:
@@ -40,27 +66,21 @@ def get_smiles_for_inchikeys(inchikeys_df: pd.DataFrame, config) -> pd.DataFrame
     inchikey_col = config.INCHIKEY_COL
     smiles_col = config.SMILES_COL
     
-    # 1. 加载SMILES查询字典（如果尚未加载）
+    # 1. 加载SMILES查询表（如果尚未加载）
     _load_smiles_lookup(config)
 
-    # 2. 从输入的DataFrame中获取所有唯一的InChIKey
-    unique_inchikeys = inchikeys_df[inchikey_col].unique()
-    
-    # 3. 在内存字典中执行查找
-    results = []
-    for inchikey in tqdm(unique_inchikeys, desc="从本地文件获取SMILES"):
-        smiles = _smiles_lookup.get(inchikey)
-        if smiles is None:
-            logging.warning(f"在本地文件中未找到InChIKey {inchikey} 对应的SMILES。")
-        results.append({inchikey_col: inchikey, smiles_col: smiles})
-
-    # 4. 将查询结果转换为DataFrame，并与原始DataFrame合并
-    df_smiles = pd.DataFrame(results)
-    df_with_smiles = pd.merge(inchikeys_df, df_smiles, on=inchikey_col, how='left')
-
-    # 5. 报告查找结果并清理
-    original_count = len(unique_inchikeys)
-    found_count = df_with_smiles[smiles_col].notna().sum()
+    # 2. 用reindex在索引哈希表上一次性完成查找，结果按输入行顺序对齐
+    keys = inchikeys_df[inchikey_col].astype("string[pyarrow]")
+    mapped = _smiles_lookup.reindex(keys.values).values
+    df_with_smiles = inchikeys_df.assign(**{smiles_col: mapped})
+
+    # 3. 报告查找结果
+    # 未命中的InChIKey汇总后只记录一条警告，而不是每个键各写一次日志
+    original_count = inchikeys_df[inchikey_col].nunique()
+    missing_inchikeys = inchikeys_df.loc[pd.isna(mapped), inchikey_col].dropna().unique()
+    if len(missing_inchikeys) > 0:
+        logging.warning("在本地文件中未找到 %d 个InChIKey对应的SMILES (示例: %s)。", len(missing_inchikeys), list(missing_inchikeys[:5]))
+    found_count = original_count - len(missing_inchikeys)
     logging.info(f"从本地文件中，成功为 {found_count} / {original_count} 个独立的InChIKey找到SMILES。")
     
     # 根据原始逻辑，删除那些未能找到SMILES的行
@@ -104,8 +124,9 @@ def prepare_training_data(positive_inchikeys_df: pd.DataFrame, config, run_outpu
     df_unlabeled.drop_duplicates(subset=[config.SMILES_COL], inplace=True)
 
     # 3. 确保未标记样本与正样本不重复
-    positive_smiles_set = set(df_positive[config.SMILES_COL])
-    df_unlabeled_clean = df_unlabeled[~df_unlabeled[config.SMILES_COL].isin(positive_smiles_set)]
+    # 直接传入去重后的数组，避免先建Python set、再在isin内部转回列表重新哈希
+    positive_smiles = df_positive[config.SMILES_COL].unique()
+    df_unlabeled_clean = df_unlabeled[~df_unlabeled[config.SMILES_COL].isin(positive_smiles)]
     logging.info(f"去除与正样本重复的项后，可用的未标记样本数: {len(df_unlabeled_clean)}")
 
     # 4. 按10倍比例随机下采样未标记样本
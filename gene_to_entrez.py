@@ -3,27 +3,34 @@ gene_to_entrez.py - 将基因名称(Gene Symbol)转换为EntrezID
 """
 import requests
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
-def gene_symbols_to_entrez(gene_symbols: list, species: str = "human") -> pd.DataFrame:
+def gene_symbols_to_entrez(gene_symbols: list, species: str = "human", max_workers: int = 8) -> pd.DataFrame:
     """
     将基因符号列表转换为EntrezID
     
     参数:
         gene_symbols: 基因符号列表，如 ["TP53", "EGFR", "BRCA1"]
         species: 物种，默认 "human"，也可以是 "mouse", "rat" 等
+        max_workers: 并发请求的线程数，各批次通过同一个Session复用连接
     
     返回:
         DataFrame 包含 symbol, entrezgene, name 等信息
     """
     url = "https://mygene.info/v3/query"
     
-    results = []
-    
     # 批量查询（每次最多1000个）
     batch_size = 1000
-    for i in range(0, len(gene_symbols), batch_size):
-        batch = gene_symbols[i:i+batch_size]
-        
+    batches = [gene_symbols[i:i+batch_size] for i in range(0, len(gene_symbols), batch_size)]
+    if not batches:
+        return pd.DataFrame()
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+    session.mount("https://", adapter)
+
+    def fetch_batch(batch):
         params = {
             "q": ",".join(batch),
             "scopes": "symbol,alias",  # 搜索symbol和别名
@@ -31,19 +38,22 @@ def gene_symbols_to_entrez(gene_symbols: list, species: str = "human") -> pd.Dat
             "species": species,
             "size": len(batch)
         }
-        
-        response = requests.post(url, data=params)
-        data = response.json()
-        
-        for item in data:
-            if isinstance(item, dict):
-                results.append({
-                    "query": item.get("query", ""),
-                    "symbol": item.get("symbol", ""),
-                    "entrezgene": item.get("entrezgene", None),
-                    "name": item.get("name", ""),
-                    "found": "notfound" not in item
-                })
+        response = session.post(url, data=params, timeout=30)
+        return response.json()
+
+    results = []
+    # 各批次请求受网络延迟主导，并发发送以重叠等待时间；executor.map按提交顺序返回结果
+    with session, ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+        for data in executor.map(fetch_batch, batches):
+            for item in data:
+                if isinstance(item, dict):
+                    results.append({
+                        "query": item.get("query", ""),
+                        "symbol": item.get("symbol", ""),
+                        "entrezgene": item.get("entrezgene", None),
+                        "name": item.get("name", ""),
+                        "found": "notfound" not in item
+                    })
     
     return pd.DataFrame(results)
 
@@ -1,6 +1,10 @@
 import argparse
 import logging
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
 from pathlib import Path
 import sys
 
@@ -16,12 +20,14 @@ except ImportError:
           "并且'config.py'存在于同一文件夹中。")
     sys.exit(1)
 
+from data_pipeline.cache_utils import string_types_mapper
+
 # 配置日志系统
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def find_inchikeys_by_entrez(entrez_ids_set: set) -> pd.DataFrame:
+def find_inchikeys_by_entrez(entrez_ids_set) -> pd.DataFrame:
     """
-    根据给定的EntrezID集合，从主数据文件中查找对应的InChIKey。
+    根据给定的EntrezID集合（字符串集合或pyarrow字符串数组），从主数据文件中查找对应的InChIKey。
     返回一个包含EntrezID和InChIKey配对的DataFrame。
     """
     source_file_path = config.TCM_DATA_ROOT / config.INCHIKEY_ENTREZ_FILE
@@ -34,25 +40,31 @@ def find_inchikeys_by_entrez(entrez_ids_set: set) -> pd.DataFrame:
 
     logging.info(f"正在从 {source_file_path} 为 {len(entrez_ids_set)} 个EntrezID查找InChIKey...")
 
-    chunk_size = 1_000_000
-    found_matches_dfs = []
-    
+    # 由pyarrow.dataset扫描TSV并在C++层完成EntrezID过滤，只有匹配的行才会转换为pandas对象
+    csv_format = ds.CsvFileFormat(
+        parse_options=pacsv.ParseOptions(delimiter='\t'),
+        convert_options=pacsv.ConvertOptions(column_types={inchikey_col: pa.string(), entrez_id_col: pa.string()}),
+    )
+    if isinstance(entrez_ids_set, pa.Array):
+        needles = entrez_ids_set
+    else:
+        needles = pa.array(list(entrez_ids_set), type=pa.string())
     try:
-        with pd.read_csv(source_file_path, sep='\t', usecols=[inchikey_col, entrez_id_col], chunksize=chunk_size, dtype=str) as reader:
-            for i, chunk in enumerate(reader):
-                logging.info(f"正在处理数据块 {i+1}...")
-                matches = chunk[chunk[entrez_id_col].isin(entrez_ids_set)]
-                if not matches.empty:
-                    found_matches_dfs.append(matches)
+        dataset = ds.dataset(source_file_path, format=csv_format)
+        table = dataset.to_table(
+            columns=[inchikey_col, entrez_id_col],
+            filter=pc.field(entrez_id_col).isin(needles),
+        )
     except Exception as e:
         logging.error(f"读取或处理文件时发生错误: {e}")
         return pd.DataFrame(columns=[inchikey_col, entrez_id_col])
 
-    if not found_matches_dfs:
+    if table.num_rows == 0:
         logging.info("查找完毕，未找到任何匹配项。")
         return pd.DataFrame(columns=[inchikey_col, entrez_id_col])
 
-    df_all_matches = pd.concat(found_matches_dfs, ignore_index=True)
+    # 结果列保持为Arrow字符串，后续的去重和分组统计都不再经过Python字符串对象
+    df_all_matches = table.to_pandas(types_mapper=string_types_mapper)
     df_all_matches.drop_duplicates(inplace=True)
     
     logging.info(f"查找完毕。共找到 {len(df_all_matches)} 个独特的 EntrezID-InChIKey 对。")
@@ -72,9 +84,9 @@ def main():
     )
     args = parser.parse_args()
     
-    entrez_id_set = {e.strip() for e in args.entrez_ids.split(',')}
+    entrez_id_needles = pc.unique(pc.utf8_trim_whitespace(pa.array(args.entrez_ids.split(','), type=pa.string())))
     
-    df_matches = find_inchikeys_by_entrez(entrez_id_set)
+    df_matches = find_inchikeys_by_entrez(entrez_id_needles)
     
     if not df_matches.empty:
         inchikey_col = config.INCHIKEY_COL
@@ -3,26 +3,29 @@ import logging
 from datetime import datetime
 from pathlib import Path
 
+import pyarrow as pa
+import pyarrow.compute as pc
+
 # 导入项目模块
 import config
 from data_pipeline import data_loader, data_preparer
 from modeling import trainer, predictor
 from scoring import ranker
 
-def main():
-    """项目主入口函数"""
-    
-    # --- 1. 设置和解析参数 ---
-    parser = argparse.ArgumentParser(description="根据EntrezID，预测并排名相关中药。")
-    parser.add_argument(
-        "--entrez_ids", 
-        type=str, 
-        required=True, 
-        help="一个或多个用逗号分隔的EntrezID (例如: '2,19,23')"
-    )
-    args = parser.parse_args()
-    entrez_ids_str = args.entrez_ids
-    entrez_id_set = set(entrez_ids_str.split(','))
+def run_pipeline(entrez_ids):
+    """
+    为给定的EntrezID列表执行完整流程（查找正样本、训练、预测、排名）。
+    可被其他脚本直接导入调用，避免额外启动一个Python解释器。
+
+    Args:
+        entrez_ids: 一个或多个EntrezID (字符串或整数)。
+
+    Returns:
+        Path | None: 最终中药排名文件的路径；流程失败时返回None。
+    """
+    entrez_ids_str = ",".join(str(e).strip() for e in entrez_ids)
+    # 在入口处一次性转换为去重后的Arrow字符串数组，下游直接在Arrow内核中解析和匹配
+    entrez_id_needles = pc.unique(pa.array(entrez_ids_str.split(','), type=pa.string()))
     
     logging.info(f"===== 开始为EntrezID集合 '{entrez_ids_str}' 生成中药排名 =====")
 
@@ -35,32 +38,14 @@ def main():
     run_models_dir.mkdir(parents=True, exist_ok=True)
     
     # --- 2b. 配置日志系统 ---
+    # 只为本次运行追加一个写入run.log的文件处理器，调用方已配置的处理器（控制台、其他日志文件）保持不变，
+    # 流程结束后移除并关闭该处理器
     log_file_path = run_output_dir / "run.log"
-    
-    # 获取根日志记录器
     logger = logging.getLogger()
-    logger.setLevel(logging.INFO) # 设置总级别
-    
-    # 如果已有处理器，先清除，防止重复记录
-    if logger.hasHandlers():
-        logger.handlers.clear()
-        
-    # 创建文件处理器，写入日志文件
     file_handler = logging.FileHandler(log_file_path, mode='w', encoding='utf-8')
     file_handler.setLevel(logging.INFO)
-    
-    # 创建控制台处理器，打印到屏幕
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    
-    # 定义日志格式
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
-    
-    # 将处理器添加到根日志记录器
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
     logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
 
     logging.info(f"日志将同时输出到控制台和文件: {log_file_path}")
     logging.info(f"本次运行的输出将保存在: {run_output_dir}")
@@ -70,10 +55,10 @@ def main():
         # --- 3. 执行数据和模型流程 ---
         
         # 步骤 1: 查找正样本
-        positive_samples_df = data_loader.find_positive_samples_by_entrez(entrez_id_set, config)
+        positive_samples_df = data_loader.find_positive_samples_by_entrez(entrez_id_needles, config)
         if positive_samples_df.empty:
             logging.error("未能找到任何正样本，流程终止。")
-            return
+            return None
 
         # 步骤 2: 准备训练数据
         training_data_path = data_preparer.prepare_training_data(positive_samples_df, config, run_output_dir)
@@ -89,10 +74,38 @@ def main():
 
         logging.info(f"===== 流程成功结束！ =====")
         logging.info(f"最终的中药排名报告已生成: {final_ranking_path}")
+        return final_ranking_path
 
     except Exception as e:
         logging.error(f"在执行过程中发生严重错误: {e}", exc_info=True)
         logging.info("===== 流程因错误而终止 =====")
+        return None
+    finally:
+        logger.removeHandler(file_handler)
+        file_handler.close()
+
+def main():
+    """项目主入口函数"""
+    
+    # --- 设置和解析参数 ---
+    parser = argparse.ArgumentParser(description="根据EntrezID，预测并排名相关中药。")
+    parser.add_argument(
+        "--entrez_ids", 
+        type=str, 
+        required=True, 
+        help="一个或多个用逗号分隔的EntrezID (例如: '2,19,23')"
+    )
+    args = parser.parse_args()
+
+    # 作为独立脚本运行时由入口统一配置根日志记录器（控制台输出），run_pipeline只追加本次运行的日志文件。
+    # force=True 替换导入各模块时 basicConfig 已安装的默认处理器，防止重复记录
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        force=True
+    )
+    
+    run_pipeline(args.entrez_ids.split(','))
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
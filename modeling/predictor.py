@@ -1,15 +1,27 @@
+import hashlib
+import os
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import torch
 import logging
 from pathlib import Path
 
-from chemprop.data import MoleculeDatapoint, MoleculeDataset, build_dataloader
+from torch.utils.data import DataLoader
+from chemprop.data import MoleculeDatapoint, MoleculeDataset, collate_batch
 from chemprop.models.model import MPNN
 from chemprop import featurizers
-from lightning import pytorch as pl
 
 from data_pipeline.data_preparer import get_smiles_for_inchikeys # 复用SMILES转换逻辑
+from data_pipeline.cache_utils import copy_file_atomic, string_types_mapper
+
+def _autocast_dtype(config):
+    """辅助函数：返回GPU上混合精度预测使用的数据类型，未启用或无GPU时返回None"""
+    if not getattr(config, 'USE_MIXED_PRECISION', False) or not torch.cuda.is_available():
+        return None
+    return torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
 
 def predict_with_ensemble(models_dir: Path, data_to_predict: pd.DataFrame, config) -> pd.DataFrame:
     """
@@ -22,33 +34,62 @@ def predict_with_ensemble(models_dir: Path, data_to_predict: pd.DataFrame, confi
     points = [MoleculeDatapoint.from_smi(smi, y=None) for smi in smis]
     featurizer = featurizers.SimpleMoleculeMolGraphFeaturizer()
     dset = MoleculeDataset(points, featurizer)
-    loader = build_dataloader(dset, num_workers=config.NUM_WORKERS, shuffle=False)
+    # GPU上使用锁页内存加速主机到设备的拷贝；多进程加载时预取批次
+    # 加载器只会被完整遍历一次，因此无需常驻工作进程
+    loader_kwargs = {'pin_memory': torch.cuda.is_available()}
+    if config.NUM_WORKERS > 0:
+        loader_kwargs.update(prefetch_factor=4)
+    # 不使用build_dataloader：它在 len(dset) % batch_size == 1 时强制drop_last，预测时最后一个化合物会被丢弃
+    loader = DataLoader(
+        dset, batch_size=64, shuffle=False, num_workers=config.NUM_WORKERS,
+        collate_fn=collate_batch, drop_last=False, **loader_kwargs
+    )
     
-    all_preds = []
     model_files = sorted(models_dir.glob("*.ckpt"))
     
     if not model_files:
         logging.error(f"在 {models_dir} 中未找到任何模型文件(.ckpt)。")
         raise FileNotFoundError(f"No model checkpoints found in {models_dir}")
 
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    autocast_dtype = _autocast_dtype(config)
+    # 先加载全部模型（集成中的MPNN都很小），再只遍历一次数据加载器：
+    # 每个批次只移动到设备一次并依次交给所有模型，用完即释放，不在内存或显存中保留整个化合物库的批次
+    models = []
     for model_path in model_files:
-        logging.info(f"正在使用模型 {model_path.name} 进行预测...")
-        model = MPNN.load_from_checkpoint(
-            model_path,
-            map_location=torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        )
-        trainer = pl.Trainer(accelerator="auto", devices=1, logger=False)
-        
-        with torch.inference_mode():
-            preds = trainer.predict(model, loader)
-        
-        # 展平并收集预测结果
-        # preds 是一个列表的列表，需要将它们连接成一个一维数组
-        preds_flat = np.concatenate([p.flatten() for p in preds])
-        all_preds.append(preds_flat)
+        logging.info(f"正在加载模型 {model_path.name}...")
+        model = MPNN.load_from_checkpoint(model_path, map_location=device)
+        model.eval()
+        models.append(model)
+
+    ensemble_preds = np.empty(len(data_to_predict), dtype=np.float64)
+    offset = 0
+    # 直接调用模型前向计算，不经过Trainer的predict循环
+    with torch.inference_mode():
+        for batch in loader:
+            bmg, V_d, X_d, *_ = batch
+            bmg.to(device)
+            V_d = V_d.to(device) if V_d is not None else None
+            X_d = X_d.to(device) if X_d is not None else None
+            # 逐模型累加当前批次的预测值，累加器保持float64，避免多个模型平均时的精度损失
+            batch_sum = None
+            for model in models:
+                with torch.autocast(device_type=device.type, dtype=autocast_dtype, enabled=autocast_dtype is not None):
+                    batch_preds = model(bmg, V_d, X_d)
+                # 低精度输出先转回float32再转为float64累加
+                batch_preds = batch_preds.float().cpu().numpy().ravel().astype(np.float64)
+                batch_sum = batch_preds if batch_sum is None else batch_sum + batch_preds
+            ensemble_preds[offset:offset + len(batch_sum)] = batch_sum / len(models)
+            offset += len(batch_sum)
+            del bmg, V_d, X_d, batch
+
+    if offset != len(data_to_predict):
+        raise RuntimeError(f"预测结果数量 ({offset}) 与待预测化合物数量 ({len(data_to_predict)}) 不一致。")
 
-    # 计算集成预测的平均值
-    ensemble_preds = np.mean(all_preds, axis=0)
+    # 释放模型占用的显存
+    del models, model
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
     
     # 将预测结果添加到DataFrame中
     data_to_predict['predicted_probability'] = ensemble_preds
@@ -56,15 +97,69 @@ def predict_with_ensemble(models_dir: Path, data_to_predict: pd.DataFrame, confi
     
     return data_to_predict
 
+# 预测缓存格式版本，预测逻辑或输出格式改变时递增，使旧缓存全部失效
+PREDICTION_CACHE_VERSION = "2"
+
+def _prediction_cache_key(models_dir: Path, config) -> str:
+    """
+    辅助函数：由缓存格式版本、影响输出的推理设置（混合精度开关及实际使用的autocast类型）、
+    所有模型检查点的内容以及化合物库、SMILES文件的大小和修改时间计算预测缓存的键。
+    只要其中任一项发生变化，键就会改变。
+    """
+    digest = hashlib.sha1()
+    digest.update(f"v{PREDICTION_CACHE_VERSION}|".encode())
+    digest.update(f"{getattr(config, 'USE_MIXED_PRECISION', False)}|{_autocast_dtype(config)}|".encode())
+    for model_path in sorted(models_dir.glob("*.ckpt")):
+        digest.update(model_path.name.encode())
+        with open(model_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    for data_path in (config.TCM_DATA_ROOT / config.HERB_COMPOUNDS_FILE, config.LOCAL_INCHIKEY_SMILES_TSV):
+        stat = data_path.stat()
+        digest.update(f"{data_path}|{stat.st_size}|{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+def _evict_prediction_cache(config):
+    """辅助函数：按最近使用时间淘汰多余的预测缓存，只保留 PREDICTION_CACHE_SIZE 个"""
+    cached = sorted(config.CACHE_DIR.glob("preds_*.parquet"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for stale_path in cached[config.PREDICTION_CACHE_SIZE:]:
+        stale_path.unlink(missing_ok=True)
+
+
+def _save_predictions(table: pa.Table, output_path: Path):
+    """辅助函数：由pyarrow的多线程写出器完成CSV序列化，并额外保存一份Parquet供排名步骤快速读取"""
+    pacsv.write_csv(table, output_path)
+    pq.write_table(table, output_path.with_suffix('.parquet'), compression='zstd')
+
+
 def generate_compound_predictions(models_dir: Path, config, run_output_dir: Path) -> Path:
     """
     对整个中药化合物库进行预测。
+    相同的模型和化合物库已经预测过时，直接复用CACHE_DIR中的结果。
     """
+    output_path = run_output_dir / "compound_predictions.csv"
+    cache_path = config.CACHE_DIR / f"preds_{_prediction_cache_key(models_dir, config)}.parquet"
+    if cache_path.exists():
+        logging.info(f"命中预测缓存: {cache_path}，跳过模型推理。")
+        os.utime(cache_path)  # 刷新最近使用时间
+        _save_predictions(pq.read_table(cache_path), output_path)
+        logging.info(f"化合物预测分数已保存至: {output_path}")
+        return output_path
+
     # 1. 加载中药化合物库 (InChIKeys)
     herb_compounds_path = config.TCM_DATA_ROOT / config.HERB_COMPOUNDS_FILE
     logging.info(f"正在加载中药化合物库: {herb_compounds_path}")
-    df_compounds = pd.read_csv(herb_compounds_path, sep='\t', usecols=[config.INCHIKEY_COL, config.CHP_ID_COL])
-    df_compounds.drop_duplicates(subset=[config.INCHIKEY_COL], inplace=True)
+    # 由pyarrow读取并按InChIKey做哈希去重（保留首次出现的CHP_ID），去重后再转换为pandas
+    table = pacsv.read_csv(
+        herb_compounds_path,
+        parse_options=pacsv.ParseOptions(delimiter='\t'),
+        convert_options=pacsv.ConvertOptions(include_columns=[config.INCHIKEY_COL, config.CHP_ID_COL])
+    )
+    source_columns = table.column_names
+    table = table.group_by([config.INCHIKEY_COL], use_threads=False).aggregate([(config.CHP_ID_COL, "first")])
+    df_compounds = table.rename_columns({f"{config.CHP_ID_COL}_first": config.CHP_ID_COL}).select(source_columns) \
+        .to_pandas(types_mapper=string_types_mapper)
     
     # 2. 为化合物获取SMILES
     df_compounds_with_smiles = get_smiles_for_inchikeys(df_compounds, config)
@@ -76,9 +171,12 @@ def generate_compound_predictions(models_dir: Path, config, run_output_dir: Path
     # 3. 使用模型集成进行预测
     df_predictions = predict_with_ensemble(models_dir, df_compounds_with_smiles, config)
     
-    # 4. 保存预测结果
-    output_path = run_output_dir / "compound_predictions.csv"
-    df_predictions.to_csv(output_path, index=False)
+    # 4. 保存预测结果，并写入预测缓存供之后相同的模型和化合物库复用
+    table = pa.Table.from_pandas(df_predictions, preserve_index=False)
+    _save_predictions(table, output_path)
     logging.info(f"化合物预测分数已保存至: {output_path}")
+
+    copy_file_atomic(output_path.with_suffix('.parquet'), cache_path)
+    _evict_prediction_cache(config)
     
     return output_path 
\ No newline at end of file
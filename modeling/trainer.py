@@ -2,6 +2,7 @@ import pandas as pd
 import numpy as np
 import torch
 import os
+import multiprocessing
 import logging
 from pathlib import Path
 from joblib import Parallel, delayed
@@ -11,12 +12,30 @@ from chemprop.models.model import MPNN
 from chemprop.nn import BondMessagePassing, MeanAggregation, BinaryClassificationFFN
 from chemprop import featurizers
 from lightning import pytorch as pl
+from torch.utils.data import Subset
 
-def train_single_model(fold_idx, train_pos, unlabeled_groups, config, run_models_dir):
+def _trainer_precision(config) -> str:
+    """辅助函数：根据配置和当前GPU选择Lightning的precision参数，CPU上保持fp32"""
+    if not getattr(config, 'USE_MIXED_PRECISION', False) or not torch.cuda.is_available():
+        return "32-true"
+    return "bf16-mixed" if torch.cuda.is_bf16_supported() else "16-mixed"
+
+def train_single_model(fold_idx, full_dset, pos_idx, unlabeled_idx, config, run_models_dir, gpu_queue=None):
     """
     训练单个基学习器模型。
     这是一个被并行调用的辅助函数。
+    多GPU时从gpu_queue中取出一块空闲GPU独占使用，训练结束后归还。
     """
+    if gpu_queue is None:
+        return _train_single_model_on_device(fold_idx, full_dset, pos_idx, unlabeled_idx, config, run_models_dir, None)
+    gpu_id = gpu_queue.get()
+    try:
+        return _train_single_model_on_device(fold_idx, full_dset, pos_idx, unlabeled_idx, config, run_models_dir, gpu_id)
+    finally:
+        gpu_queue.put(gpu_id)
+
+def _train_single_model_on_device(fold_idx, full_dset, pos_idx, unlabeled_idx, config, run_models_dir, gpu_id):
+    """辅助函数：在指定GPU（gpu_id为None时由Lightning自动选择设备）上训练单个基学习器"""
     fold_seed = config.RANDOM_SEED + fold_idx
     np.random.seed(fold_seed)
     torch.manual_seed(fold_seed)
@@ -24,13 +43,15 @@ def train_single_model(fold_idx, train_pos, unlabeled_groups, config, run_models
         torch.cuda.manual_seed(fold_seed)
 
     # 准备当前fold的数据
-    current_unlabeled = unlabeled_groups[fold_idx]
-    train_data = train_pos + current_unlabeled
+    # 所有fold共用同一个MoleculeDataset，只按索引取出正样本和当前fold的未标记样本
+    train_dset = Subset(full_dset, np.concatenate([pos_idx, unlabeled_idx]))
     
-    # chemprop数据集和加载器
-    featurizer = featurizers.SimpleMoleculeMolGraphFeaturizer()
-    train_dset = MoleculeDataset(train_data, featurizer)
-    train_loader = build_dataloader(train_dset, num_workers=config.NUM_WORKERS, shuffle=True)
+    # chemprop数据加载器
+    # GPU上使用锁页内存加速主机到设备的拷贝；多进程加载时保持工作进程常驻并预取批次
+    loader_kwargs = {'pin_memory': torch.cuda.is_available()}
+    if config.NUM_WORKERS > 0:
+        loader_kwargs.update(persistent_workers=True, prefetch_factor=4)
+    train_loader = build_dataloader(train_dset, num_workers=config.NUM_WORKERS, shuffle=True, **loader_kwargs)
     
     # 定义模型
     model = MPNN(
@@ -44,14 +65,15 @@ def train_single_model(fold_idx, train_pos, unlabeled_groups, config, run_models
         logger=False,
         enable_checkpointing=False,
         enable_progress_bar=True,
-        accelerator="auto",
-        devices=1,
+        accelerator="auto" if gpu_id is None else "gpu",
+        devices=1 if gpu_id is None else [gpu_id],
         max_epochs=config.MAX_EPOCHS,
+        precision=_trainer_precision(config),
         deterministic=True
     )
 
     # 训练
-    logging.info(f"[Fold {fold_idx}] 开始训练，包含 {len(train_pos)} 个正样本和 {len(current_unlabeled)} 个未标记样本。")
+    logging.info(f"[Fold {fold_idx}] 开始训练，包含 {len(pos_idx)} 个正样本和 {len(unlabeled_idx)} 个未标记样本。")
     trainer.fit(model, train_loader)
     
     # 保存模型
@@ -72,35 +94,41 @@ def train_pu_model_ensemble(training_data_path: Path, config, run_models_dir: Pa
     smis = df_train[config.SMILES_COL].values
     ys = df_train[config.TARGET_COL].values
     all_data = [MoleculeDatapoint.from_smi(smi, [y]) for smi, y in zip(smis, ys)]
+    # 整个训练集只构建一次数据集，各基学习器通过索引数组取子集
+    featurizer = featurizers.SimpleMoleculeMolGraphFeaturizer()
+    full_dset = MoleculeDataset(all_data, featurizer)
     
-    positive_data = [d for d in all_data if d.y[0] == 1]
-    unlabeled_data = [d for d in all_data if d.y[0] == 0]
+    pos_idx = np.flatnonzero(ys == 1)
+    unlabeled_idx = np.flatnonzero(ys == 0)
     
-    if not positive_data:
+    if len(pos_idx) == 0:
         logging.error("训练数据中没有正样本，无法进行训练。")
         raise ValueError("No positive samples for training.")
 
     # 2. 将未标记样本分层分配到各基学习器
-    n_unlabeled = len(unlabeled_data)
-    group_size = n_unlabeled // config.N_ESTIMATORS
-    unlabeled_groups = []
-    indices = np.random.permutation(n_unlabeled)
+    # 各基学习器只持有索引数组，样本本身只保留一份
+    unlabeled_splits = np.array_split(np.random.permutation(unlabeled_idx), config.N_ESTIMATORS)
 
-    for i in range(config.N_ESTIMATORS):
-        start_idx = i * group_size
-        end_idx = (i + 1) * group_size if i != config.N_ESTIMATORS - 1 else n_unlabeled
-        group_indices = indices[start_idx:end_idx]
-        unlabeled_groups.append([unlabeled_data[j] for j in group_indices])
-
-    # 3. 并行训练所有模型
-    logging.info(f"将并行训练 {config.N_ESTIMATORS} 个模型...")
-    
-    # 注意：在Windows上，joblib的并行执行可能需要将辅助函数放在可导入的模块中
-    # 我们这里的结构是符合这个要求的
-    Parallel(n_jobs=-1)(
-        delayed(train_single_model)(i, positive_data, unlabeled_groups, config, run_models_dir)
-        for i in range(config.N_ESTIMATORS)
-    )
+    # 3. 训练所有模型
+    # 单GPU或纯CPU时多个进程只会争抢同一设备，因此顺序训练；
+    # 多GPU时每块GPU对应一个工作进程，通过队列分配设备，保证同一时刻每块GPU只训练一个模型
+    n_gpus = torch.cuda.device_count()
+    if n_gpus <= 1:
+        logging.info(f"将顺序训练 {config.N_ESTIMATORS} 个模型...")
+        for i in range(config.N_ESTIMATORS):
+            train_single_model(i, full_dset, pos_idx, unlabeled_splits[i], config, run_models_dir)
+    else:
+        logging.info(f"将在 {n_gpus} 块GPU上并行训练 {config.N_ESTIMATORS} 个模型...")
+        # 注意：在Windows上，joblib的并行执行可能需要将辅助函数放在可导入的模块中
+        # 我们这里的结构是符合这个要求的
+        with multiprocessing.Manager() as manager:
+            gpu_queue = manager.Queue()
+            for gpu_id in range(n_gpus):
+                gpu_queue.put(gpu_id)
+            Parallel(n_jobs=n_gpus, backend='loky')(
+                delayed(train_single_model)(i, full_dset, pos_idx, unlabeled_splits[i], config, run_models_dir, gpu_queue)
+                for i in range(config.N_ESTIMATORS)
+            )
 
     logging.info("所有基学习器训练完成。")
     return run_models_dir 
\ No newline at end of file
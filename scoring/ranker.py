@@ -1,4 +1,7 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import logging
 from pathlib import Path
 import argparse
@@ -8,6 +11,14 @@ import sys
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 import config
 
+def _write_csv(df: pd.DataFrame, output_path: Path):
+    """使用pyarrow的多线程CSV写出器保存DataFrame；按列逐个转换，允许输出列中出现重复列名"""
+    table = pa.Table.from_arrays(
+        [pa.Array.from_pandas(df.iloc[:, i]) for i in range(df.shape[1])],
+        names=[str(c) for c in df.columns]
+    )
+    pacsv.write_csv(table, output_path)
+
 def rank_herbs(compound_predictions_path: Path, config, run_output_dir: Path) -> Path:
     """
     根据化合物的预测分数，对中药进行聚合评分和排名。
@@ -23,8 +34,14 @@ def rank_herbs(compound_predictions_path: Path, config, run_output_dir: Path) ->
     logging.info("开始对中药进行评分和排名...")
 
     # 1. 加载化合物预测结果
-    logging.info(f"正在加载化合物预测分数: {compound_predictions_path}")
-    df_preds = pd.read_csv(compound_predictions_path)
+    # 预测步骤会在CSV旁写出同名Parquet，若其不比CSV旧则优先读取
+    parquet_path = Path(compound_predictions_path).with_suffix('.parquet')
+    if parquet_path.exists() and parquet_path.stat().st_mtime >= Path(compound_predictions_path).stat().st_mtime:
+        logging.info(f"正在加载化合物预测分数: {parquet_path}")
+        df_preds = pd.read_parquet(parquet_path)
+    else:
+        logging.info(f"正在加载化合物预测分数: {compound_predictions_path}")
+        df_preds = pd.read_csv(compound_predictions_path, engine='pyarrow')
     
     # 检查预测文件是否已经包含 CHP_ID 列
     if config.CHP_ID_COL not in df_preds.columns:
@@ -35,95 +52,119 @@ def rank_herbs(compound_predictions_path: Path, config, run_output_dir: Path) ->
         df_herb_map = pd.read_csv(
             herb_compounds_path, 
             usecols=[config.INCHIKEY_COL, config.CHP_ID_COL],
-            sep='\t' # 使用正则表达式匹配一个或多个空白字符作为分隔符
+            sep='\t',
+            engine='pyarrow' # 多线程C++解析
         )
         # 将预测分数与CHP_ID合并
-        df_merged = pd.merge(df_preds, df_herb_map, on=config.INCHIKEY_COL, how='left')
-        df_merged.dropna(subset=[config.CHP_ID_COL], inplace=True)
+        if df_herb_map[config.INCHIKEY_COL].is_unique:
+            # 每个化合物只属于一味中药时，直接按哈希查找补上CHP_ID列，不再通过merge生成新表
+            chp_lookup = pd.Series(df_herb_map[config.CHP_ID_COL].values, index=df_herb_map[config.INCHIKEY_COL].values)
+            df_preds[config.CHP_ID_COL] = df_preds[config.INCHIKEY_COL].map(chp_lookup)
+            df_merged = df_preds.dropna(subset=[config.CHP_ID_COL])
+        else:
+            # 一个化合物可能出现在多味中药中，此时需要merge展开为多行
+            df_merged = pd.merge(df_preds, df_herb_map, on=config.INCHIKEY_COL, how='left')
+            df_merged.dropna(subset=[config.CHP_ID_COL], inplace=True)
+        del df_herb_map
     else:
         # 如果预测文件中已经包含 CHP_ID，直接使用
         logging.info("预测文件中已包含 CHP_ID 列，直接使用...")
-        df_merged = df_preds.copy()
-        df_merged.dropna(subset=[config.CHP_ID_COL], inplace=True)
+        df_merged = df_preds.dropna(subset=[config.CHP_ID_COL])
+    # 之后只使用df_merged，尽早释放原始预测表
+    del df_preds
 
     # 3. 按CHP_ID聚合分数，计算多种排名指标
     logging.info("正在按中药ID (CHP_ID) 聚合分数...")
     
-    def calculate_herb_metrics(group):
-        """计算单个中药的多种评分指标"""
-        scores = group['predicted_probability']
-        
-        # 基础统计
-        total_compounds = len(scores)
-        total_score = scores.sum()
-        avg_score = scores.mean() if total_compounds > 0 else 0
-        
-        # 有效成分（不为0）的统计
-        effective_scores = scores[scores > 0]
-        effective_count = len(effective_scores)
-        effective_avg = effective_scores.mean() if effective_count > 0 else 0
-        
-        # 高质量成分（大于0.8）的统计
-        high_quality_scores = scores[scores > 0.8]
-        high_quality_count = len(high_quality_scores)
-        high_quality_avg = high_quality_scores.mean() if high_quality_count > 0 else 0
-        
-        # 超高质量成分（大于0.9）的统计
-        ultra_high_scores = scores[scores > 0.9]
-        ultra_high_count = len(ultra_high_scores)
-        ultra_high_avg = ultra_high_scores.mean() if ultra_high_count > 0 else 0
-        
-        # 其他有用的指标
-        max_score = scores.max()
-        median_score = scores.median()
-        std_score = scores.std()
-        
-        # 质量分布比例
-        effective_ratio = effective_count / total_compounds if total_compounds > 0 else 0
-        high_quality_ratio = high_quality_count / total_compounds if total_compounds > 0 else 0
-        ultra_high_ratio = ultra_high_count / total_compounds if total_compounds > 0 else 0
-        
-        return pd.Series({
-            'total_compounds': total_compounds,
-            'total_score': total_score,
-            'avg_score': avg_score,
-            'effective_count': effective_count,
-            'effective_avg': effective_avg,
-            'effective_ratio': effective_ratio,
-            'high_quality_count': high_quality_count,
-            'high_quality_avg': high_quality_avg,
-            'high_quality_ratio': high_quality_ratio,
-            'ultra_high_count': ultra_high_count,
-            'ultra_high_avg': ultra_high_avg,
-            'ultra_high_ratio': ultra_high_ratio,
-            'max_score': max_score,
-            'median_score': median_score,
-            'std_score': std_score
-        })
-    
-    df_herb_scores = df_merged.groupby(config.CHP_ID_COL).apply(calculate_herb_metrics).reset_index()
+    # 所有指标都表示为同一次分组聚合中的列运算，不再逐组调用Python函数。
+    # 各阈值下的条件统计通过where将不满足条件的分数置为NaN，count/mean会自动忽略这些值
+    scores = df_merged['predicted_probability']
+    df_scores = pd.DataFrame({
+        # 分组键转为分类类型，分组时只需哈希整数编码而不是逐个字符串
+        config.CHP_ID_COL: df_merged[config.CHP_ID_COL].astype('category'),
+        'score': scores,
+        'effective': scores.where(scores > 0),          # 有效成分（不为0）
+        'high_quality': scores.where(scores > 0.8),     # 高质量成分（大于0.8）
+        'ultra_high': scores.where(scores > 0.9),       # 超高质量成分（大于0.9）
+    })
+    df_herb_scores = df_scores.groupby(config.CHP_ID_COL, observed=True).agg(
+        total_compounds=('score', 'size'),
+        total_score=('score', 'sum'),
+        avg_score=('score', 'mean'),
+        effective_count=('effective', 'count'),
+        effective_avg=('effective', 'mean'),
+        high_quality_count=('high_quality', 'count'),
+        high_quality_avg=('high_quality', 'mean'),
+        ultra_high_count=('ultra_high', 'count'),
+        ultra_high_avg=('ultra_high', 'mean'),
+        max_score=('score', 'max'),
+        median_score=('score', 'median'),
+        std_score=('score', 'std'),
+    )
+    # 某一档没有成分时平均分记为0
+    avg_cols = ['effective_avg', 'high_quality_avg', 'ultra_high_avg']
+    df_herb_scores[avg_cols] = df_herb_scores[avg_cols].fillna(0)
 
-    # 计算贝叶斯平滑平均分（抗小样本波动）
+    # 质量分布比例、贝叶斯平滑平均分和综合评分在同一次assign中基于聚合结果计算，
+    # 综合评分通过lambda引用刚算出的adj_avg_score，合并名称后无需再对整张排名表追加列
     global_mean = df_merged['predicted_probability'].mean()
     alpha = getattr(config, 'BAYESIAN_ALPHA', 10)
-    df_herb_scores['adj_avg_score'] = (
-        (df_herb_scores['total_score'] + alpha * global_mean) /
-        (df_herb_scores['total_compounds'] + alpha)
+    total = df_herb_scores['total_compounds']
+    df_herb_scores = df_herb_scores.assign(
+        effective_ratio=df_herb_scores['effective_count'] / total,
+        high_quality_ratio=df_herb_scores['high_quality_count'] / total,
+        ultra_high_ratio=df_herb_scores['ultra_high_count'] / total,
+        # 贝叶斯平滑平均分（抗小样本波动）
+        adj_avg_score=(df_herb_scores['total_score'] + alpha * global_mean) / (total + alpha),
+        # 综合评分（多指标加权）
+        comprehensive_score=lambda d: (
+            0.3 * d['adj_avg_score'] +
+            0.2 * d['effective_avg'] +
+            0.2 * d['high_quality_avg'] +
+            0.15 * d['ultra_high_count'] / d['ultra_high_count'].max() +
+            0.15 * d['high_quality_ratio']
+        ),
     )
 
+    # 与原先逐组返回pd.Series时的列顺序和浮点类型保持一致，输出文件格式不变
+    df_herb_scores = df_herb_scores[[
+        'total_compounds', 'total_score', 'avg_score',
+        'effective_count', 'effective_avg', 'effective_ratio',
+        'high_quality_count', 'high_quality_avg', 'high_quality_ratio',
+        'ultra_high_count', 'ultra_high_avg', 'ultra_high_ratio',
+        'max_score', 'median_score', 'std_score',
+        'adj_avg_score', 'comprehensive_score'
+    ]].astype(float).reset_index()
+
     # 4. 关联中药名称
     herb_names_path = config.TCM_DATA_ROOT / config.HERB_NAMES_FILE
     logging.info(f"正在加载中药名称: {herb_names_path}")
-    df_herb_names = pd.read_csv(herb_names_path, usecols=[config.CHP_ID_COL, config.CHINESE_HERB_COL],sep='\t')
+    df_herb_names = pd.read_csv(herb_names_path, usecols=[config.CHP_ID_COL, config.CHINESE_HERB_COL], sep='\t', engine='pyarrow')
     
     # 在输出目录中保存一个带中药名称列的化合物预测文件，便于查看
+    # 按行分块关联名称并追加写出，内存中同时只存在一个分块的关联结果，而不是整张表的副本。
+    # 同时写出字典编码的Parquet版本，供下游脚本按列读取；CSV导出可通过配置关闭
+    preds_with_names_path = run_output_dir / "compound_predictions_with_names.csv"
+    export_csv = getattr(config, 'EXPORT_NAMED_PREDICTIONS_CSV', True)
+    parquet_writer = None
     try:
-        df_preds_with_names = pd.merge(df_merged, df_herb_names, on=config.CHP_ID_COL, how='left')
-        preds_with_names_path = run_output_dir / "compound_predictions_with_names.csv"
-        df_preds_with_names.to_csv(preds_with_names_path, index=False)
-        logging.info(f"已生成带中药名称的化合物预测文件: {preds_with_names_path}")
+        chunk_size = 500_000
+        for start in range(0, max(len(df_merged), 1), chunk_size):
+            chunk = pd.merge(df_merged.iloc[start:start + chunk_size], df_herb_names, on=config.CHP_ID_COL, how='left')
+            if export_csv:
+                chunk.to_csv(preds_with_names_path, index=False, mode='w' if start == 0 else 'a', header=start == 0)
+            if parquet_writer is None:
+                # 全为空值的列按字符串处理，保证后续分块的类型一致
+                schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+                schema = pa.schema([f.with_type(pa.string()) if pa.types.is_null(f.type) else f for f in schema])
+                parquet_writer = pq.ParquetWriter(preds_with_names_path.with_suffix('.parquet'), schema, compression='zstd')
+            parquet_writer.write_table(pa.Table.from_pandas(chunk, schema=parquet_writer.schema, preserve_index=False))
+        logging.info(f"已生成带中药名称的化合物预测文件: {preds_with_names_path.with_suffix('.parquet')}")
     except Exception as e:
         logging.warning(f"生成带中药名称的化合物预测文件失败: {e}")
+    finally:
+        if parquet_writer is not None:
+            parquet_writer.close()
 
     df_final_ranking = pd.merge(df_herb_scores, df_herb_names, on=config.CHP_ID_COL, how='left')
     
@@ -143,25 +184,12 @@ def rank_herbs(compound_predictions_path: Path, config, run_output_dir: Path) ->
         'max_score': ('最高成分分数排名', 'max_score', False)
     }
     
-    # 计算综合评分（多指标加权）
-    df_final_ranking['comprehensive_score'] = (
-        0.3 * df_final_ranking['adj_avg_score'] +
-        0.2 * df_final_ranking['effective_avg'] +
-        0.2 * df_final_ranking['high_quality_avg'] +
-        0.15 * df_final_ranking['ultra_high_count'] / df_final_ranking['ultra_high_count'].max() +
-        0.15 * df_final_ranking['high_quality_ratio']
-    )
-    
     # 生成各种排名文件
+    # 每种排名只对需要输出的列排序，不复制整张表；各排名的前10行保留在内存中供汇总报告复用
     output_files = []
+    top_outputs = {}
     
     for method_key, (method_name, sort_col, ascending) in ranking_methods.items():
-        df_ranked = df_final_ranking.copy()
-        df_ranked = df_ranked.sort_values(by=sort_col, ascending=ascending)
-        
-        # 添加排名列
-        df_ranked['rank'] = range(1, len(df_ranked) + 1)
-        
         # 选择输出列
         if method_key == 'comprehensive':
             output_cols = [
@@ -175,11 +203,16 @@ def rank_herbs(compound_predictions_path: Path, config, run_output_dir: Path) ->
                 'total_compounds', 'effective_count', 'high_quality_count', 'ultra_high_count'
             ]
         
-        df_output = df_ranked[output_cols]
+        # 输出列中可能包含重复的排序列，因此先对排序列单独求出行顺序，再按该顺序取出输出列
+        order = df_final_ranking[sort_col].sort_values(ascending=ascending).index
+        df_output = df_final_ranking.loc[order, output_cols[1:]]
+        # 添加排名列
+        df_output.insert(0, 'rank', range(1, len(df_output) + 1))
+        top_outputs[method_key] = df_output.head(10)
         
         # 保存文件
         output_path = run_output_dir / f"herb_ranking_{method_key}.csv"
-        df_output.to_csv(output_path, index=False)
+        _write_csv(df_output, output_path)
         output_files.append((method_name, output_path))
         
         logging.info(f"{method_name}已生成: {output_path}")
@@ -215,22 +248,15 @@ def rank_herbs(compound_predictions_path: Path, config, run_output_dir: Path) ->
         
         # 重新排序，将综合排名放在最前面
         ordered_methods = [
-            ('综合排名', run_output_dir / "herb_ranking_comprehensive.csv"),
-            ('平均分排名', run_output_dir / "herb_ranking_avg_score.csv"),
-            ('贝叶斯平均分排名', run_output_dir / "herb_ranking_adj_avg_score.csv"),
-            ('有效成分平均分排名', run_output_dir / "herb_ranking_effective_avg.csv"),
-            ('高质量成分平均分排名', run_output_dir / "herb_ranking_high_quality_avg.csv"),
-            ('超高质量成分数量排名', run_output_dir / "herb_ranking_ultra_high_count.csv"),
-            ('超高质量成分平均分排名', run_output_dir / "herb_ranking_ultra_high_avg.csv"),
-            ('质量比例排名', run_output_dir / "herb_ranking_quality_ratio.csv"),
-            ('最高成分分数排名', run_output_dir / "herb_ranking_max_score.csv")
+            'comprehensive', 'avg_score', 'adj_avg_score', 'effective_avg', 'high_quality_avg',
+            'ultra_high_count', 'ultra_high_avg', 'quality_ratio', 'max_score'
         ]
         
-        for method_name, file_path in ordered_methods:
-            f.write(f"\n{method_name}:\n")
-            df_top = pd.read_csv(file_path).head(10)
-            for idx, row in df_top.iterrows():
-                f.write(f"  {row['rank']}. {row[config.CHINESE_HERB_COL]} ({row[config.CHP_ID_COL]})\n")
+        for method_key in ordered_methods:
+            f.write(f"\n{ranking_methods[method_key][0]}:\n")
+            df_top = top_outputs[method_key]
+            for row in df_top.itertuples(index=False):
+                f.write(f"  {row.rank}. {getattr(row, config.CHINESE_HERB_COL)} ({getattr(row, config.CHP_ID_COL)})\n")
     
     logging.info(f"汇总报告已生成: {summary_path}")
     
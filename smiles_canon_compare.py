@@ -10,6 +10,9 @@ smiles_canon_compare.py
      python smiles_canon_compare.py --file smiles.txt
 """
 import argparse
+import os
+from multiprocessing import Pool
+import numpy as np
 from typing import List, Tuple, Optional
 
 def try_import_rdkit():
@@ -40,22 +43,30 @@ def canon_with_rdkit(smiles: str, Chem, AllChem, Descriptors, rdInchi) -> Tuple[
     except Exception:
         return None, None, None
 
-def compare_strings(a: Optional[str], b: Optional[str]) -> str:
-    if a is None or b is None:
-        return "N/A"
-    return "==" if a == b else "!="
+# 子进程内缓存的 RDKit 模块，每个工作进程只导入一次
+_rdkit_modules = None
 
-def make_pairwise_matrix(rows: List[str]) -> List[List[str]]:
+def canon_smiles(smiles: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """供进程池调用的单参数版本：在当前进程内导入 RDKit 后规范化一个 SMILES"""
+    global _rdkit_modules
+    if _rdkit_modules is None:
+        _rdkit_modules = try_import_rdkit()
+    return canon_with_rdkit(smiles, *_rdkit_modules)
+
+def make_pairwise_matrix(rows: List[Optional[str]]) -> List[List[str]]:
+    """一次广播比较得到 n×n 对比结果（相等 '=='，不等 '!='，任一方缺失为 'N/A'），再加上表头行/列"""
     n = len(rows)
-    mat = [["" for _ in range(n+1)] for _ in range(n+1)]
-    mat[0][0] = "#"
-    for i in range(n):
-        mat[0][i+1] = f"S{i+1}"
-        mat[i+1][0] = f"S{i+1}"
-    for i in range(n):
-        for j in range(n):
-            mat[i+1][j+1] = compare_strings(rows[i], rows[j])
-    return mat
+    # 先为每个不同的键分配一个整数编号（缺失为-1），n×n 的比较就只是整数数组的广播相等判断
+    tag_of = {}
+    tags = np.fromiter((tag_of.setdefault(r, len(tag_of)) if r is not None else -1 for r in rows), dtype=np.int64, count=n)
+    missing = tags == -1
+    out = np.select(
+        [missing[:, None] | missing[None, :], tags[:, None] == tags[None, :]],
+        ["N/A", "=="],
+        default="!=",
+    ).astype(object)
+    header = [f"S{i+1}" for i in range(n)]
+    return [["#"] + header] + [[name] + row for name, row in zip(header, out.tolist())]
 
 def print_table(table: List[List[str]]):
     colw = [max(len(str(x)) for x in col) for col in zip(*table)]
@@ -87,9 +98,16 @@ def main():
         print("未检测到 RDKit。请先安装：pip install rdkit-pypi")
         return
 
+    # 各 SMILES 相互独立，输入较多时分块交给进程池并行规范化；imap 保持输入顺序
+    chunksize = 64
+    if len(inputs) > chunksize and (os.cpu_count() or 1) > 1:
+        with Pool(os.cpu_count()) as pool:
+            results = list(pool.imap(canon_smiles, inputs, chunksize=chunksize))
+    else:
+        results = [canon_with_rdkit(s, Chem, AllChem, Descriptors, rdInchi) for s in inputs]
+
     records = []
-    for idx, s in enumerate(inputs, 1):
-        cano, inchi, inchikey = canon_with_rdkit(s, Chem, AllChem, Descriptors, rdInchi)
+    for idx, (s, (cano, inchi, inchikey)) in enumerate(zip(inputs, results), 1):
         records.append({
             "id": f"S{idx}",
             "input": s,
@@ -10,6 +10,7 @@
 """
 import pandas as pd
 import argparse
+from pathlib import Path
 
 # 解析命令行参数
 parser = argparse.ArgumentParser(description='输出排名前N的中药及其Top M化合物')
@@ -24,7 +25,17 @@ TOP_COMPOUNDS = args.top_compounds
 
 # 读取数据
 herb_ranking = pd.read_csv('outputs/entrez_run_2025-12-24_11-34-54/herb_ranking_comprehensive.csv')
-compound_predictions = pd.read_csv('outputs/entrez_run_2025-12-24_11-34-54/compound_predictions_with_names.csv')
+# 优先读取排名步骤写出的Parquet版本（仅当其不比CSV旧时），只解码需要的列
+compound_columns = ['CHP_ID', 'InChIKey', 'SMILES', 'predicted_probability']
+compound_predictions_path = Path('outputs/entrez_run_2025-12-24_11-34-54/compound_predictions_with_names.csv')
+compound_parquet_path = compound_predictions_path.with_suffix('.parquet')
+if compound_parquet_path.exists() and (
+    not compound_predictions_path.exists()
+    or compound_parquet_path.stat().st_mtime >= compound_predictions_path.stat().st_mtime
+):
+    compound_predictions = pd.read_parquet(compound_parquet_path, columns=compound_columns)
+else:
+    compound_predictions = pd.read_csv(compound_predictions_path, usecols=compound_columns)
 
 # 获取前N名中药
 top_n_herbs = herb_ranking.head(TOP_HERBS)
@@ -33,27 +44,28 @@ print("=" * 80)
 print(f"排名前{TOP_HERBS}的中药及其Top {TOP_COMPOUNDS}化合物")
 print("=" * 80)
 
+# 一次排序 + 分组取前M个，得到所有入选中药的Top化合物，再按CHP_ID建立字典
+top_herb_compounds = compound_predictions[compound_predictions['CHP_ID'].isin(top_n_herbs['CHP_ID'])]
+top_herb_compounds = top_herb_compounds.dropna(subset=['predicted_probability']) \
+    .sort_values('predicted_probability', ascending=False, kind='stable') \
+    .groupby('CHP_ID', sort=False).head(TOP_COMPOUNDS)
+top_by_herb = {chp_id: group for chp_id, group in top_herb_compounds.groupby('CHP_ID', sort=False)}
+empty = top_herb_compounds.iloc[0:0]
+
 results = []
 
-for idx, row in top_n_herbs.iterrows():
-    chp_id = row['CHP_ID']
-    herb_name = row['Chinese_herbal_pieces']
-    rank = row['rank']
-    score = row['comprehensive_score']
-    
+# 逐行遍历时使用itertuples得到普通元组，避免iterrows为每一行构造Series
+herb_rows = top_n_herbs[['CHP_ID', 'Chinese_herbal_pieces', 'rank', 'comprehensive_score']].itertuples(index=False, name=None)
+for chp_id, herb_name, rank, score in herb_rows:
+
     print(f"\n【第{int(rank)}名】{herb_name} ({chp_id})")
     print(f"    综合评分: {score:.4f}")
     print("-" * 60)
     
-    # 筛选该中药的化合物，按预测分数排序
-    herb_compounds = compound_predictions[compound_predictions['CHP_ID'] == chp_id]
-    top_m_compounds = herb_compounds.nlargest(TOP_COMPOUNDS, 'predicted_probability')
+    top_m_compounds = top_by_herb.get(chp_id, empty)
     
-    for i, (_, comp) in enumerate(top_m_compounds.iterrows(), 1):
-        inchikey = comp['InChIKey']
-        smiles = comp['SMILES']
-        prob = comp['predicted_probability']
-        
+    compound_rows = top_m_compounds[['InChIKey', 'SMILES', 'predicted_probability']].itertuples(index=False, name=None)
+    for i, (inchikey, smiles, prob) in enumerate(compound_rows, 1):
         print(f"    化合物 {i}:")
         print(f"      InChIKey: {inchikey}")
         print(f"      SMILES: {smiles}")
@@ -1,18 +1,29 @@
 import argparse
+import functools
 import pandas as pd
+import pyarrow as pa
 from pathlib import Path
 import config
 import logging
+from data_pipeline import data_loader
+from data_pipeline.cache_utils import is_cache_fresh, write_parquet_atomic
 
 # --- 日志配置 ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def load_data(file_path, usecols=None, sep='\t'):
-    """安全地加载TSV数据"""
+@functools.lru_cache(maxsize=32)
+def _read_tsv_cached(file_path, usecols, sep, engine):
+    """按 (路径, 列, 分隔符, 解析引擎) 缓存解析结果，重复调用时直接返回已加载的DataFrame；读取失败时不缓存"""
+    # pyarrow引擎在C++中多线程解析，且不支持low_memory参数
+    extra = {'low_memory': False} if engine == 'c' else {}
+    df = pd.read_csv(file_path, sep=sep, usecols=list(usecols) if usecols is not None else None, engine=engine, **extra)
+    logging.info(f"成功加载文件: {file_path}")
+    return df
+
+def load_data(file_path, usecols=None, sep='\t', engine='pyarrow'):
+    """安全地加载TSV数据，默认使用pyarrow引擎解析，可通过engine='c'切换回pandas解析器（结果会被缓存，调用方不应修改返回的DataFrame）"""
     try:
-        df = pd.read_csv(file_path, sep=sep, usecols=usecols, low_memory=False)
-        logging.info(f"成功加载文件: {file_path}")
-        return df
+        return _read_tsv_cached(Path(file_path), tuple(usecols) if usecols is not None else None, sep, engine)
     except FileNotFoundError:
         logging.error(f"错误: 文件未找到 {file_path}")
         return None
@@ -20,6 +31,84 @@ def load_data(file_path, usecols=None, sep='\t'):
         logging.error(f"加载文件 {file_path} 时出错: {e}")
         return None
 
+# 全局变量，缓存由两列映射文件构建的 键 -> frozenset(值) 查询字典，键为 (文件路径, 键列, 值列)
+_set_lookups = {}
+
+def load_set_lookup(file_path, key_col, value_col):
+    """
+    将两列映射文件转换为 键 -> frozenset(值) 的查询字典并缓存，之后的查找都是字典命中；加载失败时返回None。
+    只用于较小的映射文件（ICD11 -> CUI/MeSH/DOID），D13这类大表不应整体转换为Python对象。
+    """
+    cache_key = (Path(file_path), key_col, value_col)
+    if cache_key not in _set_lookups:
+        df = load_data(file_path, usecols=(key_col, value_col))
+        if df is None:
+            return None
+        _set_lookups[cache_key] = df.groupby(key_col)[value_col].apply(frozenset).to_dict()
+    return _set_lookups[cache_key]
+
+def _lookup_union(lookup, keys) -> set:
+    """辅助函数：返回多个键在查询字典中对应值集合的并集"""
+    result = set()
+    if lookup is not None:
+        for key in keys:
+            result.update(lookup.get(key, ()))
+    return result
+
+# 全局变量，缓存合并后的 (来源, 概念ID, EntrezID) 长表及由其构建的 (来源, 概念ID) -> frozenset(EntrezID) 查询字典
+_concept_targets = None
+_concept_target_lookup = None
+
+def _concept_target_sources():
+    """三个疾病概念 -> 靶点映射文件的 (来源名称, 文件名, 概念ID列)"""
+    return [
+        ("CUI", config.CUI_TARGETS_FILE, config.CUI_COL),
+        ("MeSH", config.MESH_TARGETS_FILE, config.MESH_COL),
+        ("DOID", config.DOID_TARGETS_FILE, config.DOID_COL),
+    ]
+
+def _ensure_concept_targets_parquet():
+    """
+    确保 D22/D23/D24 合并后的长表Parquet缓存存在且是最新的，返回缓存路径；所有源文件都无法加载时返回None。
+    缓存元数据记录了参与构建的源文件，当前可用的源文件与之不一致或任一源文件比缓存新时重新构建。
+    """
+    parquet_path = config.CACHE_DIR / config.CONCEPT_TARGETS_PARQUET
+    source_paths = [config.TCM_DATA_ROOT / file_name for _, file_name, _ in _concept_target_sources()]
+    if is_cache_fresh(parquet_path, source_paths, track_sources=True):
+        return parquet_path
+
+    logging.info(f"正在构建疾病概念 -> 靶点合并表: {parquet_path}（仅需执行一次）")
+    frames = []
+    used_files = set()
+    for source, file_name, concept_col in _concept_target_sources():
+        df = load_data(config.TCM_DATA_ROOT / file_name, usecols=(concept_col, config.ENTREZ_ID_COL))
+        if df is None:
+            continue
+        used_files.add(file_name)
+        frames.append(pd.DataFrame({
+            'source': source,
+            'concept': df[concept_col],
+            config.ENTREZ_ID_COL: df[config.ENTREZ_ID_COL],
+        }))
+    if not frames:
+        return None
+
+    df_concept_targets = pd.concat(frames, ignore_index=True)
+    write_parquet_atomic(pa.Table.from_pandas(df_concept_targets, preserve_index=False), parquet_path, source_files=used_files)
+    logging.info(f"疾病概念 -> 靶点合并表已生成，共 {len(df_concept_targets)} 条关联。")
+    return parquet_path
+
+def load_concept_targets():
+    """加载合并长表并构建 (来源, 概念ID) -> frozenset(EntrezID) 查询字典，结果缓存在全局变量中；加载失败时返回 (None, None)"""
+    global _concept_targets, _concept_target_lookup
+    if _concept_targets is None:
+        parquet_path = _ensure_concept_targets_parquet()
+        if parquet_path is None:
+            return None, None
+        _concept_targets = pd.read_parquet(parquet_path)
+        _concept_target_lookup = _concept_targets.groupby(['source', 'concept'])[config.ENTREZ_ID_COL].apply(frozenset).to_dict()
+    return _concept_targets, _concept_target_lookup
+
 def trace_targets(inchikey: str, icd_codes: list[str]):
     """
     根据InChIKey和ICD编码追溯共同的靶点。
@@ -32,49 +121,50 @@ def trace_targets(inchikey: str, icd_codes: list[str]):
 
     # --- 1. 查找化合物的靶点 ---
     report.append("\n--- 步骤 1: 查找化合物靶点 ---")
-    df_inchi_entrez = load_data(config.TCM_DATA_ROOT / config.INCHIKEY_ENTREZ_FILE, usecols=[config.INCHIKEY_COL, config.ENTREZ_ID_COL])
-    if df_inchi_entrez is None:
+    # D13体量很大，只对其Parquet缓存做按InChIKey过滤的读取，不整体加载
+    try:
+        compound_targets = data_loader.find_entrez_ids_by_inchikey(inchikey, config)
+    except Exception as e:
+        logging.error(f"加载化合物-靶点数据时出错: {e}")
         report.append("错误: 无法加载化合物-靶点数据，流程终止。")
         return "\\n".join(report)
-        
-    compound_targets_df = df_inchi_entrez[df_inchi_entrez[config.INCHIKEY_COL] == inchikey]
-    compound_targets = set(compound_targets_df[config.ENTREZ_ID_COL].unique())
     
     report.append(f"从 {config.INCHIKEY_ENTREZ_FILE} 中找到 {len(compound_targets)} 个与 {inchikey} 相关的靶点:")
     report.append(f"  -> 靶点 (EntrezIDs): {compound_targets if compound_targets else '无'}")
 
+    # 化合物没有任何靶点时不可能存在共同靶点，跳过疾病侧映射文件的加载和查找
+    if not compound_targets:
+        report.append("\n化合物未找到任何靶点，跳过疾病靶点查找。")
+        report.append("未找到任何共同靶点。")
+        report.append("\n" + "=" * 50)
+        report.append("报告结束。")
+        return "\\n".join(report)
+
     # --- 2. 查找疾病的靶点 ---
     report.append("\n--- 步骤 2: 查找疾病相关靶点 ---")
     
     # a. ICD -> CUI/MeSH/DOID
-    df_icd_cui = load_data(config.TCM_DATA_ROOT / config.DISEASE_ICD11_FILE, usecols=[config.ICD11_CODE_COL, config.CUI_COL])
-    df_icd_mesh = load_data(config.TCM_DATA_ROOT / config.ICD11_MESH_FILE, usecols=[config.ICD11_CODE_COL, config.MESH_COL])
-    df_icd_doid = load_data(config.TCM_DATA_ROOT / config.ICD11_DOID_FILE, usecols=[config.ICD11_CODE_COL, config.DOID_COL])
+    icd_to_cuis = load_set_lookup(config.TCM_DATA_ROOT / config.DISEASE_ICD11_FILE, config.ICD11_CODE_COL, config.CUI_COL)
+    icd_to_meshes = load_set_lookup(config.TCM_DATA_ROOT / config.ICD11_MESH_FILE, config.ICD11_CODE_COL, config.MESH_COL)
+    icd_to_doids = load_set_lookup(config.TCM_DATA_ROOT / config.ICD11_DOID_FILE, config.ICD11_CODE_COL, config.DOID_COL)
 
-    disease_cuis = set(df_icd_cui[df_icd_cui[config.ICD11_CODE_COL].isin(icd_codes)][config.CUI_COL].unique()) if df_icd_cui is not None else set()
-    disease_meshes = set(df_icd_mesh[df_icd_mesh[config.ICD11_CODE_COL].isin(icd_codes)][config.MESH_COL].unique()) if df_icd_mesh is not None else set()
-    disease_doids = set(df_icd_doid[df_icd_doid[config.ICD11_CODE_COL].isin(icd_codes)][config.DOID_COL].unique()) if df_icd_doid is not None else set()
+    disease_cuis = _lookup_union(icd_to_cuis, icd_codes)
+    disease_meshes = _lookup_union(icd_to_meshes, icd_codes)
+    disease_doids = _lookup_union(icd_to_doids, icd_codes)
     
     report.append("ICD 编码到医学概念的映射:")
     report.append(f"  - CUI: {disease_cuis if disease_cuis else '无'}")
     report.append(f"  - MeSH: {disease_meshes if disease_meshes else '无'}")
     report.append(f"  - DOID: {disease_doids if disease_doids else '无'}")
 
-    # b. CUI/MeSH/DOID -> EntrezID
-    df_cui_target = load_data(config.TCM_DATA_ROOT / config.CUI_TARGETS_FILE, usecols=[config.CUI_COL, config.ENTREZ_ID_COL])
-    df_mesh_target = load_data(config.TCM_DATA_ROOT / config.MESH_TARGETS_FILE, usecols=[config.MESH_COL, config.ENTREZ_ID_COL])
-    df_doid_target = load_data(config.TCM_DATA_ROOT / config.DOID_TARGETS_FILE, usecols=[config.DOID_COL, config.ENTREZ_ID_COL])
-
-    disease_targets = set()
-    if df_cui_target is not None and disease_cuis:
-        targets = set(df_cui_target[df_cui_target[config.CUI_COL].isin(disease_cuis)][config.ENTREZ_ID_COL].unique())
-        disease_targets.update(targets)
-    if df_mesh_target is not None and disease_meshes:
-        targets = set(df_mesh_target[df_mesh_target[config.MESH_COL].isin(disease_meshes)][config.ENTREZ_ID_COL].unique())
-        disease_targets.update(targets)
-    if df_doid_target is not None and disease_doids:
-        targets = set(df_doid_target[df_doid_target[config.DOID_COL].isin(disease_doids)][config.ENTREZ_ID_COL].unique())
-        disease_targets.update(targets)
+    # b. CUI/MeSH/DOID -> EntrezID：三类概念在同一张合并表中一次查找
+    df_concept_targets, concept_target_lookup = load_concept_targets()
+    disease_concepts = (
+        [("CUI", c) for c in disease_cuis] +
+        [("MeSH", c) for c in disease_meshes] +
+        [("DOID", c) for c in disease_doids]
+    )
+    disease_targets = _lookup_union(concept_target_lookup, disease_concepts)
 
     report.append(f"\n从疾病相关概念中找到 {len(disease_targets)} 个总靶点:")
     report.append(f"  -> 靶点 (EntrezIDs): {disease_targets if disease_targets else '无'}")
@@ -87,20 +177,20 @@ def trace_targets(inchikey: str, icd_codes: list[str]):
         report.append(f"成功找到 {len(common_targets)} 个共同靶点！")
         report.append(f"  -> 共同靶点 (EntrezID): {common_targets}")
         report.append("\n详细追溯路径:")
+        # 合并表只对共同靶点过滤并分组一次，得到 (来源, 靶点) -> 来源概念列表 的字典，避免逐靶点重复扫描
+        concepts_by_source_target = {}
+        if df_concept_targets is not None:
+            matched = df_concept_targets[df_concept_targets[config.ENTREZ_ID_COL].isin(common_targets)]
+            concepts_by_source_target = matched.groupby(['source', config.ENTREZ_ID_COL], sort=False)['concept'].agg(list).to_dict()
         for target in common_targets:
             report.append(f"  - 靶点 {target}:")
             report.append(f"    - 来源于化合物 {inchikey}")
             # 追溯疾病来源
-            source_info = []
-            if df_cui_target is not None and target in df_cui_target[config.ENTREZ_ID_COL].values:
-                cuis = df_cui_target[df_cui_target[config.ENTREZ_ID_COL] == target][config.CUI_COL]
-                source_info.append(f"通过CUI {list(cuis)}")
-            if df_mesh_target is not None and target in df_mesh_target[config.ENTREZ_ID_COL].values:
-                meshes = df_mesh_target[df_mesh_target[config.ENTREZ_ID_COL] == target][config.MESH_COL]
-                source_info.append(f"通过MeSH {list(meshes)}")
-            if df_doid_target is not None and target in df_doid_target[config.ENTREZ_ID_COL].values:
-                doids = df_doid_target[df_doid_target[config.ENTREZ_ID_COL] == target][config.DOID_COL]
-                source_info.append(f"通过DOID {list(doids)}")
+            source_info = [
+                f"通过{source} {concepts_by_source_target[(source, target)]}"
+                for source, _, _ in _concept_target_sources()
+                if (source, target) in concepts_by_source_target
+            ]
             report.append(f"    - 来源于疾病（ICD: {', '.join(icd_codes)}），关联路径: {' | '.join(source_info)}")
     else:
         report.append("未找到任何共同靶点。")
@@ -2,8 +2,13 @@ import requests
 import csv
 import io
 import time
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from typing import List, Dict, Optional
 
+import config
+
 UNIPROT_SEARCH_URL = "https://rest.uniprot.org/uniprotkb/search"
 
 def chunked(lst, n):
@@ -16,12 +21,14 @@ def build_query(ids: List[str]) -> str:
     parts = [f"accession:{i}" for i in ids]
     return " OR ".join(parts)
 
-def fetch_mapping_batch(ids: List[str], retries: int = 3, backoff: float = 1.5) -> Dict[str, Optional[str]]:
+def fetch_mapping_batch(ids: List[str], retries: int = 3, backoff: float = 1.5, session: Optional[requests.Session] = None) -> Dict[str, Optional[str]]:
     """
     批量获取UniProt ID到Entrez Gene ID的映射
     返回 {uniprot_id: entrez_gene_id or None}
     若一个条目对应多个GeneID，则以分号连接
+    传入session时复用其连接池，省去每个批次的TCP/TLS握手
     """
+    http = session if session is not None else requests
     params = {
         "query": build_query(ids),
         "fields": "accession,xref_geneid",
@@ -31,7 +38,7 @@ def fetch_mapping_batch(ids: List[str], retries: int = 3, backoff: float = 1.5)
     
     for attempt in range(retries):
         try:
-            r = requests.get(UNIPROT_SEARCH_URL, params=params, timeout=30)
+            r = http.get(UNIPROT_SEARCH_URL, params=params, timeout=30)
             r.raise_for_status()
             text = r.text
             
@@ -54,19 +61,71 @@ def fetch_mapping_batch(ids: List[str], retries: int = 3, backoff: float = 1.5)
                 return {i: None for i in ids}
             time.sleep(backoff ** attempt)
 
-def map_uniprot_to_entrez(uniprot_ids: List[str], batch_size: int = 200, sleep_between: float = 0.2) -> Dict[str, Optional[str]]:
+def _open_mapping_cache() -> sqlite3.Connection:
+    """打开（必要时创建）CACHE_DIR中的UniProt -> Entrez映射缓存"""
+    config.CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(config.CACHE_DIR / config.UNIPROT_ENTREZ_CACHE)
+    conn.execute("CREATE TABLE IF NOT EXISTS mapping(acc TEXT PRIMARY KEY, entrez TEXT, ts INTEGER)")
+    return conn
+
+def _read_cached_mappings(conn: sqlite3.Connection, ids: List[str], ttl_days: float) -> Dict[str, str]:
+    """返回缓存中未过期的映射 {acc: entrez}；分块查询以免超出SQLite的参数个数上限"""
+    min_ts = int(time.time() - ttl_days * 86400)
+    hits: Dict[str, str] = {}
+    for batch in chunked(ids, 500):
+        placeholders = ",".join("?" * len(batch))
+        rows = conn.execute(
+            f"SELECT acc, entrez FROM mapping WHERE ts >= ? AND acc IN ({placeholders})",
+            [min_ts, *batch],
+        )
+        hits.update(rows)
+    return hits
+
+def map_uniprot_to_entrez(uniprot_ids: List[str], batch_size: int = 200, sleep_between: float = 0.2, max_workers: int = 5,
+                          use_cache: bool = True) -> Dict[str, Optional[str]]:
     """
     批量映射UniProt ID到Entrez Gene ID
+    已查询到的映射持久化在CACHE_DIR的SQLite缓存中（有效期UNIPROT_CACHE_TTL_DAYS天），只有未命中的ID才发起请求；
+    未找到或请求失败的ID不写入缓存，下次仍会重新查询
+    各批次请求受网络延迟主导，使用最多max_workers个线程并发发送，以重叠等待时间；
+    所有线程共用同一个Session，复用持久连接
     返回字典：{ 'Q9H3K2': '1017', 'P04637': '1956;1957', 'BADID': None, ... }
     """
     ids = [i.strip() for i in uniprot_ids if i and i.strip()]
     result: Dict[str, Optional[str]] = {i: None for i in ids}
     
-    for batch in chunked(ids, batch_size):
-        batch_res = fetch_mapping_batch(batch)
-        for k, v in batch_res.items():
-            result[k] = v
-        time.sleep(sleep_between)  # 礼貌性限速，避免429错误
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+    session.mount("https://", adapter)
+    
+    def fetch_and_wait(batch: List[str]) -> Dict[str, Optional[str]]:
+        batch_res = fetch_mapping_batch(batch, session=session)
+        time.sleep(sleep_between)  # 礼貌性限速，避免429错误（每个并发线程各自限速）
+        return batch_res
+    
+    conn = _open_mapping_cache() if use_cache else None
+    try:
+        if conn is not None:
+            result.update(_read_cached_mappings(conn, list(result), getattr(config, 'UNIPROT_CACHE_TTL_DAYS', 30)))
+        missing = [i for i, v in result.items() if v is None]
+        
+        batches = list(chunked(missing, batch_size))
+        if batches:
+            with session, ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+                for batch_res in executor.map(fetch_and_wait, batches):
+                    for k, v in batch_res.items():
+                        result[k] = v
+                    # 只在主线程中写缓存，SQLite连接不跨线程共享
+                    if conn is not None:
+                        now = int(time.time())
+                        conn.executemany(
+                            "INSERT OR REPLACE INTO mapping(acc, entrez, ts) VALUES (?, ?, ?)",
+                            [(k, v, now) for k, v in batch_res.items() if v is not None],
+                        )
+                        conn.commit()
+    finally:
+        if conn is not None:
+            conn.close()
     
     return result
 